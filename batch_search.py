@@ -0,0 +1,137 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+from scene_store import load_or_build_scene_store
+from search_captions import CaptionSearchEngine
+
+
+def video_dir_for(library, video_path):
+    """Return the library folder holding the scene images and captions of a video."""
+    video_path = os.path.abspath(video_path)
+    name = os.path.splitext(os.path.basename(video_path))[0]
+    digest = hashlib.sha1(video_path.encode()).hexdigest()[:8]
+    return os.path.join(library, f"{name}-{digest}")
+
+
+def prepare_video(video_path, library, model_path, cache=None):
+    """
+    Detect and caption the scenes of a video unless the library already has them.
+
+    Args:
+        video_path (str): Path to the video file.
+        library (str): Folder holding one sub-folder per video.
+        model_path (str): Path to the moondream model file.
+        cache (ContentCache): Optional caption cache.
+
+    Returns:
+        str: The video's folder in the library.
+    """
+    video_dir = video_dir_for(library, video_path)
+    scene_images_folder = os.path.join(video_dir, "scene_images")
+    captions_file = os.path.join(video_dir, "scene_captions.json")
+
+    if not os.path.isdir(scene_images_folder) or not os.listdir(scene_images_folder):
+        from detect_scenes import detect_and_save_scenes
+
+        print(f"Detecting scenes in {video_path}...", file=sys.stderr)
+        detect_and_save_scenes(video_path, scene_images_folder, single_pass=True)
+    if not os.path.exists(captions_file):
+        from generate_captions import generate_captions_pipelined
+
+        print(f"Captioning scenes of {video_path}...", file=sys.stderr)
+        generate_captions_pipelined(scene_images_folder, model_path, captions_file, cache=cache)
+    return video_dir
+
+
+def run_batch(videos, queries, library, output, threshold=60, limit=None, model_path=None, cache=None,
+              workers=-1, query_chunk=1024):
+    """
+    Run every query against every video and stream the matches as JSON lines.
+
+    Each video's captions are loaded once and all queries are scored in
+    batched cdist calls, query_chunk queries at a time.
+
+    Args:
+        videos (list): Paths of the video files.
+        queries (list): Query strings.
+        library (str): Folder holding one sub-folder per video.
+        output (file): Text stream the JSON lines are written to.
+        threshold (float): Similarity threshold (0-100).
+        limit (int): Maximum number of matches per query and video (None for all).
+        model_path (str): Path to the moondream model file, used for videos not captioned yet.
+        cache (ContentCache): Optional caption cache.
+        workers (int): Number of threads used by cdist (-1 uses all cores).
+        query_chunk (int): Number of queries scored per cdist call.
+
+    Returns:
+        int: Number of matches written.
+    """
+    from detect_scenes import format_timestamp
+
+    written = 0
+    for video_path in videos:
+        video_dir = prepare_video(video_path, library, model_path, cache)
+        store = load_or_build_scene_store(
+            os.path.join(video_dir, "scene_captions.json"), os.path.join(video_dir, "scene_images")
+        )
+        engine = CaptionSearchEngine(store.captions(), workers=workers)
+
+        for chunk_start in range(0, len(queries), query_chunk):
+            chunk = queries[chunk_start:chunk_start + query_chunk]
+            for query, matches in zip(chunk, engine.search_many(chunk, threshold, limit)):
+                for scene, score in matches:
+                    scene_times = store.times(store.find(scene))
+                    record = {
+                        "video": video_path,
+                        "query": query,
+                        "scene": scene,
+                        "score": round(score, 2),
+                        "timestamp": format_timestamp(scene_times[0]) if scene_times else None,
+                    }
+                    output.write(json.dumps(record) + "\n")
+                    written += 1
+            output.flush()
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search a library of videos with a file of queries.")
+    parser.add_argument("--videos", nargs="+", required=True, help="Video files to search.")
+    parser.add_argument("--queries", required=True, help="Text file with one query per line.")
+    parser.add_argument("--library", default="library", help="Folder for per-video scene images and captions.")
+    parser.add_argument("--output", default="-", help="JSONL file for the results (- for stdout).")
+    parser.add_argument("--threshold", type=float, default=60, help="Similarity threshold (0-100).")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum matches per query and video.")
+    parser.add_argument("--model-path", default="path_to_moondream_model", help="Path to the moondream model.")
+    parser.add_argument("--profile", default=None, help="JSON file for a per-stage timing report.")
+    parser.add_argument("--profile-stage", default=None,
+                        help="Stage to run under cProfile (stats saved next to the report).")
+    args = parser.parse_args(argv)
+
+    with open(args.queries, "r") as f:
+        queries = [line.strip() for line in f if line.strip()]
+
+    from content_cache import ContentCache
+    from profiling import profiler
+
+    if args.profile:
+        cprofile_file = f"{os.path.splitext(args.profile)[0]}.{args.profile_stage}.prof" if args.profile_stage else None
+        profiler.reset(trace_memory=True, cprofile_stage=args.profile_stage, cprofile_file=cprofile_file)
+    cache = ContentCache(os.path.join(args.library, ".cache"))
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        written = run_batch(args.videos, queries, args.library, output, args.threshold, args.limit,
+                            args.model_path, cache)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if args.profile:
+            profiler.save_report(args.profile)
+            print(f"Profiling report saved to {args.profile}", file=sys.stderr)
+    print(f"Wrote {written} matches for {len(queries)} queries over {len(args.videos)} videos.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
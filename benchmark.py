@@ -0,0 +1,328 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+from detect_scenes import detect_and_save_scenes
+
+
+def make_synthetic_video(video_path, scene_lengths, size=(320, 240), fps=25):
+    """
+    Writes a video made of smooth random scenes that pan slowly, with hard cuts between them.
+
+    Args:
+        video_path (str): Path of the video file to write.
+        scene_lengths (list): Length of each scene in frames.
+        size (tuple): Frame size (width, height).
+        fps (float): Frame rate of the video.
+
+    Returns:
+        list: Frame numbers of the cuts between scenes.
+    """
+    rng = np.random.default_rng(0)
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    cuts = []
+    frame_num = 0
+    for length in scene_lengths:
+        if frame_num:
+            cuts.append(frame_num)
+        blocks = rng.integers(0, 255, (size[1] // 32 + 1, size[0] // 32 + 1, 3), dtype=np.uint8)
+        frame = cv2.resize(blocks, size, interpolation=cv2.INTER_CUBIC)
+        for i in range(length):
+            writer.write(np.roll(frame, i, axis=1))  # Slow pan inside the scene
+        frame_num += length
+    writer.release()
+    return cuts
+
+
+def cut_recall(expected_cuts, scenes, tolerance=1):
+    """
+    Fraction of expected cuts that were detected within tolerance frames.
+
+    Args:
+        expected_cuts (list): Frame numbers of the real cuts.
+        scenes (list): Scene list returned by detect_and_save_scenes.
+        tolerance (int): Maximum distance in frames between a real and a detected cut.
+
+    Returns:
+        float: Recall between 0 and 1.
+    """
+    if not expected_cuts:
+        return 1.0
+    detected = [start.frame_num for start, _ in scenes[1:]]
+    found = sum(any(abs(cut - d) <= tolerance for d in detected) for cut in expected_cuts)
+    return found / len(expected_cuts)
+
+
+def bench_scene_detection(video_path, expected_cuts, configs, tolerance=1):
+    """
+    Times detect_and_save_scenes for each configuration on the same video.
+
+    Args:
+        video_path (str): Path to the video file.
+        expected_cuts (list): Frame numbers of the real cuts.
+        configs (dict): Configuration name -> keyword arguments for detect_and_save_scenes.
+        tolerance (int): Cut tolerance in frames used for recall.
+
+    Returns:
+        dict: Configuration name -> {"seconds", "fps", "recall", "scenes"}.
+    """
+    num_frames = int(cv2.VideoCapture(video_path).get(cv2.CAP_PROP_FRAME_COUNT))
+    results = {}
+    for name, kwargs in configs.items():
+        with tempfile.TemporaryDirectory() as output_folder:
+            start = time.perf_counter()
+            scenes = detect_and_save_scenes(video_path, output_folder, **kwargs)
+            elapsed = time.perf_counter() - start
+        results[name] = {
+            "seconds": round(elapsed, 3),
+            "fps": round(num_frames / elapsed, 1),
+            "recall": cut_recall(expected_cuts, scenes, tolerance),
+            "scenes": len(scenes),
+        }
+    return results
+
+
+DETECTION_CONFIGS = {
+    "default": {},
+    "single_pass": {"single_pass": True},
+    "fast": {"single_pass": True, "downscale": 4, "frame_skip": 2},
+    "fast_refined": {"single_pass": True, "downscale": 4, "frame_skip": 2, "refine": True},
+    "fastest": {"single_pass": True, "downscale": 8, "frame_skip": 5, "refine": True},
+    "parallel": {"workers": os.cpu_count() or 1},
+}
+
+
+_SUBJECTS = ["man", "woman", "dog", "cat", "car", "robot", "plumber", "crowd", "bird", "truck", "child", "knight"]
+_ADJECTIVES = ["red", "small", "old", "bright", "dark", "happy", "giant", "blue", "shiny", "tired", "wooden"]
+_ACTIONS = ["running", "jumping", "sitting", "driving", "flying", "talking", "fighting", "eating", "dancing"]
+_PLACES = ["street", "castle", "park", "kitchen", "stage", "forest", "beach", "tunnel", "desert", "office"]
+
+
+def make_caption_corpus(num_scenes, seed=0):
+    """
+    Generates moondream-like captions for a synthetic corpus of scenes.
+
+    Args:
+        num_scenes (int): Number of scenes.
+        seed (int): Seed of the random generator, so corpora are reproducible.
+
+    Returns:
+        dict: Scene captions as {scene_number: caption}.
+    """
+    rng = np.random.default_rng(seed)
+    words = [
+        rng.integers(0, len(vocabulary), num_scenes)
+        for vocabulary in (_ADJECTIVES, _SUBJECTS, _ACTIONS, _PLACES, _ADJECTIVES, _SUBJECTS)
+    ]
+    return {
+        str(scene + 1): f"A {_ADJECTIVES[a]} {_SUBJECTS[s]} {_ACTIONS[v]} in a {_PLACES[p]} "
+                        f"next to a {_ADJECTIVES[a2]} {_SUBJECTS[s2]}."
+        for scene, (a, s, v, p, a2, s2) in enumerate(zip(*(w.tolist() for w in words)))
+    }
+
+
+def time_call(func, repeat=3):
+    """
+    Times a call several times.
+
+    Returns:
+        dict: {"best", "median"} wall-clock seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {"best": round(min(timings), 6), "median": round(statistics.median(timings), 6)}
+
+
+def bench_search(corpus_sizes, queries=("plumber", "red car", "dancing in the forest"), threshold=60, repeat=3):
+    """
+    Times search_captions_advanced and the completer on caption corpora of several sizes.
+
+    Returns:
+        dict: Benchmark name -> timings.
+    """
+    from prompt_toolkit.document import Document
+    from search_captions import CaptionCompleter, search_captions_advanced
+
+    results = {}
+    for size in corpus_sizes:
+        captions = make_caption_corpus(size)
+        results[f"search_captions_advanced/{size}"] = time_call(
+            lambda: [search_captions_advanced(captions, query, threshold) for query in queries], repeat
+        )
+        results[f"completer_build/{size}"] = time_call(lambda: CaptionCompleter(captions), repeat)
+
+        completer = CaptionCompleter(captions)
+        documents = [Document(prefix) for prefix in ("d", "da", "dan", "r", "s", "sh")]
+
+        def complete():
+            completer.clear_cache()  # Measure ranking, not the memo
+            for document in documents:
+                list(completer.get_completions(document, None))
+
+        results[f"get_completions/{size}"] = time_call(complete, repeat)
+    return results
+
+
+def bench_collage(workdir, num_images=64, size=(1280, 720), repeat=3):
+    """
+    Times create_collage on synthetic keyframes.
+
+    Returns:
+        dict: Benchmark name -> timings.
+    """
+    from create_collage import create_collage
+
+    rng = np.random.default_rng(2)
+    image_paths = []
+    for i in range(num_images):
+        blocks = rng.integers(0, 255, (size[1] // 32 + 1, size[0] // 32 + 1, 3), dtype=np.uint8)
+        image_paths.append(os.path.join(workdir, f"scene_{i + 1}.jpg"))
+        cv2.imwrite(image_paths[-1], cv2.resize(blocks, size, interpolation=cv2.INTER_CUBIC))
+    collage_file = os.path.join(workdir, "collage.png")
+    return {f"create_collage/{num_images}": time_call(lambda: create_collage(image_paths, collage_file, show=False),
+                                                      repeat)}
+
+
+def bench_extract_frames(workdir, video_path, num_timestamps=20, repeat=3):
+    """
+    Times extract_frames and extract_frames_batch at random timestamps of a video.
+
+    extract_frames runs the ffmpeg CLI and is skipped when ffmpeg is not installed.
+
+    Returns:
+        dict: Benchmark name -> timings.
+    """
+    from gemini_api import extract_frames, extract_frames_batch
+
+    cap = cv2.VideoCapture(video_path)
+    duration = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) / (cap.get(cv2.CAP_PROP_FPS) or 25.0))
+    cap.release()
+    rng = np.random.default_rng(3)
+    seconds = rng.integers(0, max(duration, 1), num_timestamps).tolist()
+    timestamps = [f"{s // 3600:02d}:{s % 3600 // 60:02d}:{s % 60:02d}" for s in seconds]
+    frame_folder = os.path.join(workdir, "frames")
+    results = {
+        f"extract_frames_batch/{num_timestamps}": time_call(
+            lambda: extract_frames_batch(timestamps, frame_folder, video_path), repeat
+        ),
+    }
+    if shutil.which("ffmpeg"):
+        results[f"extract_frames/{num_timestamps}"] = time_call(
+            lambda: extract_frames(timestamps, frame_folder, video_path), repeat
+        )
+    return results
+
+
+def run_suite(corpus_sizes=(1000, 10000, 100000, 1000000), num_scenes=40, video_size=(1280, 720),
+              detection_configs=None, repeat=3):
+    """
+    Runs every benchmark on synthetic inputs generated from fixed seeds.
+
+    Args:
+        corpus_sizes (list): Numbers of scenes in the caption corpora.
+        num_scenes (int): Number of scenes in the synthetic video.
+        video_size (tuple): Frame size of the synthetic video.
+        detection_configs (dict): Scene detection configurations (DETECTION_CONFIGS by default).
+        repeat (int): Number of timed runs per benchmark.
+
+    Returns:
+        dict: {"environment": {...}, "results": {benchmark name: {"best", "median"}}, "detection": {...}}
+    """
+    rng = np.random.default_rng(1)
+    scene_lengths = rng.integers(20, 120, num_scenes).tolist()
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        video_path = os.path.join(workdir, "synthetic.mp4")
+        expected_cuts = make_synthetic_video(video_path, scene_lengths, video_size)
+        detection = bench_scene_detection(video_path, expected_cuts, detection_configs or DETECTION_CONFIGS)
+        for name, stats in detection.items():
+            results[f"detect_and_save_scenes/{name}"] = {"best": stats["seconds"], "median": stats["seconds"]}
+        results.update(bench_search(corpus_sizes, repeat=repeat))
+        results.update(bench_collage(workdir, repeat=repeat))
+        results.update(bench_extract_frames(workdir, video_path, repeat=repeat))
+    environment = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+    }
+    return {"environment": environment, "results": results, "detection": detection}
+
+
+def find_regressions(results, baseline, tolerance=0.2, min_seconds=0.001):
+    """
+    Compares benchmark results with a baseline run.
+
+    Args:
+        results (dict): "results" of run_suite.
+        baseline (dict): "results" of an earlier run_suite.
+        tolerance (float): Allowed slowdown as a fraction of the baseline time.
+        min_seconds (float): Slowdowns smaller than this are treated as noise.
+
+    Returns:
+        list: {"benchmark", "baseline", "current", "ratio"} for each regressed benchmark.
+    """
+    regressions = []
+    for name, timings in sorted(results.items()):
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["best"], timings["best"]
+        if after > before * (1 + tolerance) and after - before > min_seconds:
+            regressions.append({"benchmark": name, "baseline": before, "current": after,
+                                "ratio": round(after / max(before, 1e-9), 2)})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark scene detection modes on a synthetic video.")
+    parser.add_argument("--scenes", type=int, default=40, help="Number of scenes in the synthetic video.")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--suite", action="store_true",
+                        help="Run the full suite (detection, search, completion, collage, frame extraction).")
+    parser.add_argument("--corpus-sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000],
+                        help="Caption corpus sizes for the search benchmarks.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark.")
+    parser.add_argument("--baseline", default="benchmark_baseline.json", help="JSON baseline to compare against.")
+    parser.add_argument("--save-baseline", action="store_true", help="Replace the baseline with this run.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging (0.2 = 20%%).")
+    args = parser.parse_args()
+
+    if not args.suite:
+        rng = np.random.default_rng(1)
+        scene_lengths = rng.integers(20, 120, args.scenes).tolist()
+        with tempfile.TemporaryDirectory() as workdir:
+            video_path = os.path.join(workdir, "synthetic.mp4")
+            expected_cuts = make_synthetic_video(video_path, scene_lengths, (args.width, args.height))
+            results = bench_scene_detection(video_path, expected_cuts, DETECTION_CONFIGS)
+        print(json.dumps(results, indent=2))
+        sys.exit(0)
+
+    run = run_suite(args.corpus_sizes, args.scenes, (args.width, args.height), repeat=args.repeat)
+    print(json.dumps(run, indent=2))
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = find_regressions(run["results"], baseline["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['benchmark']}: {regression['baseline']:.4f}s -> "
+                  f"{regression['current']:.4f}s ({regression['ratio']}x)", file=sys.stderr)
+        if not regressions:
+            print(f"No regressions against {args.baseline}.", file=sys.stderr)
+    if args.save_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"Baseline saved to {args.baseline}.", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
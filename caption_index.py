@@ -0,0 +1,187 @@
+import hashlib
+import json
+import math
+import os
+from collections import Counter
+from rapidfuzz import process, fuzz
+from profiling import profiler
+from search_captions import tokenize
+
+
+class CaptionIndex:
+    """
+    Inverted index over scene captions with BM25 ranking.
+
+    Each token maps to a posting list of {scene: term frequency}, so a query
+    only touches the postings of its own tokens instead of every caption.
+    Query tokens missing from the vocabulary fall back to their closest
+    fuzzy matches in the vocabulary. A digest of each indexed caption is
+    kept so that changed captions can be found and re-indexed.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        """
+        Args:
+            k1 (float): BM25 term frequency saturation.
+            b (float): BM25 document length normalization.
+        """
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_lengths = {}
+        self.caption_digests = {}
+        self.total_length = 0
+        # Tokens of each scene, so removing a scene only touches its own postings
+        self._scene_tokens = {}
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def __contains__(self, scene):
+        return str(scene) in self.doc_lengths
+
+    def add(self, scene, caption):
+        """
+        Add or replace the caption of a single scene.
+
+        Args:
+            scene (str): Scene number.
+            caption (str): Caption text.
+        """
+        scene = str(scene)
+        if scene in self.doc_lengths:
+            self.remove(scene)
+        tokens = tokenize(caption)
+        counts = Counter(tokens)
+        for token, count in counts.items():
+            self.postings.setdefault(token, {})[scene] = count
+        self._scene_tokens[scene] = list(counts)
+        self.doc_lengths[scene] = len(tokens)
+        self.caption_digests[scene] = _digest(caption)
+        self.total_length += len(tokens)
+
+    def remove(self, scene):
+        """Remove a scene from the index."""
+        scene = str(scene)
+        if scene not in self.doc_lengths:
+            return
+        for token in self._scene_tokens.pop(scene, []):
+            posting = self.postings[token]
+            posting.pop(scene, None)
+            if not posting:
+                del self.postings[token]
+        self.total_length -= self.doc_lengths.pop(scene)
+        self.caption_digests.pop(scene, None)
+
+    def update(self, captions):
+        """
+        Bring the index in line with the captions: add new scenes, re-index
+        changed captions and remove scenes that no longer have one.
+
+        Args:
+            captions (dict): Scene captions as {scene_number: caption}.
+
+        Returns:
+            int: Number of scenes added, re-indexed or removed.
+        """
+        captions = {str(scene): caption for scene, caption in captions.items()}
+        changed = 0
+        for scene in [scene for scene in self.doc_lengths if scene not in captions]:
+            self.remove(scene)
+            changed += 1
+        for scene, caption in captions.items():
+            if self.caption_digests.get(scene) != _digest(caption):
+                self.add(scene, caption)
+                changed += 1
+        return changed
+
+    def _expand(self, token, threshold, max_expansions):
+        """Return [(vocabulary token, weight)] for a query token."""
+        if token in self.postings:
+            return [(token, 1.0)]
+        matches = process.extract(
+            token, self.postings.keys(), scorer=fuzz.ratio,
+            score_cutoff=threshold, limit=max_expansions,
+        )
+        return [(match, score / 100) for match, score, _ in matches]
+
+    def search(self, query, threshold=60, limit=None, max_expansions=3):
+        """
+        Rank scenes for a query with BM25.
+
+        Args:
+            query (str): Search query.
+            threshold (float): Similarity threshold (0-100) for fuzzy token fallback.
+            limit (int): Maximum number of results (None for all).
+            max_expansions (int): Maximum vocabulary tokens a missing query token expands to.
+
+        Returns:
+            list: List of (scene, score) tuples, best match first.
+        """
+        num_docs = len(self.doc_lengths)
+        if not num_docs:
+            return []
+        avg_length = self.total_length / num_docs or 1
+        scores = {}
+        with profiler.stage("search", items=1):
+            for token in set(tokenize(query)):
+                for term, weight in self._expand(token, threshold, max_expansions):
+                    posting = self.postings[term]
+                    idf = math.log(1 + (num_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                    for scene, tf in posting.items():
+                        norm = 1 - self.b + self.b * self.doc_lengths[scene] / avg_length
+                        bm25 = idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+                        scores[scene] = scores.get(scene, 0.0) + weight * bm25
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:limit] if limit is not None else ranked
+
+    def save(self, index_file):
+        """Save the index to a JSON file, replacing it atomically."""
+        data = {
+            "k1": self.k1,
+            "b": self.b,
+            "doc_lengths": self.doc_lengths,
+            "caption_digests": self.caption_digests,
+            "postings": self.postings,
+        }
+        tmp_file = f"{index_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_file, index_file)
+
+    @classmethod
+    def load(cls, index_file):
+        """Load an index saved with :meth:`save`."""
+        with open(index_file, "r") as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"])
+        index.postings = data["postings"]
+        index.doc_lengths = data["doc_lengths"]
+        # Indexes saved without digests are re-indexed by the next update
+        index.caption_digests = data.get("caption_digests", {})
+        index.total_length = sum(index.doc_lengths.values())
+        for token, posting in index.postings.items():
+            for scene in posting:
+                index._scene_tokens.setdefault(scene, []).append(token)
+        return index
+
+
+def _digest(caption):
+    return hashlib.sha1(caption.encode()).hexdigest()[:16]
+
+
+def load_or_build_index(index_file, captions):
+    """
+    Load the caption index from disk, updating the scenes whose captions are missing or changed.
+
+    Args:
+        index_file (str): Path of the index JSON file.
+        captions (dict): Scene captions as {scene_number: caption}.
+
+    Returns:
+        CaptionIndex: The up-to-date index.
+    """
+    index = CaptionIndex.load(index_file) if os.path.exists(index_file) else CaptionIndex()
+    if index.update(captions) or not os.path.exists(index_file):
+        index.save(index_file)
+    return index
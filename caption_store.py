@@ -0,0 +1,96 @@
+import json
+import os
+
+
+def store_path_for(captions_file):
+    """Return the path of the caption log kept next to a captions JSON file."""
+    return os.path.splitext(captions_file)[0] + ".jsonl"
+
+
+class CaptionStore:
+    """
+    Append-only caption log, one JSON object per line.
+
+    Every caption is written and flushed to disk as soon as it is produced,
+    so an interrupted run resumes from the last committed scene. Readers can
+    follow the log while it is being written with :meth:`read_new`.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path of the JSONL log file.
+        """
+        self.path = path
+        self._file = None
+        self._offset = 0
+
+    def load(self):
+        """
+        Read every committed caption.
+
+        Returns:
+            dict: Scene captions as {scene_number: caption}.
+        """
+        self._offset = 0
+        return self.read_new()
+
+    def read_new(self):
+        """
+        Read captions committed since the previous load or read_new call.
+
+        A partially written last line is left for the next call.
+
+        Returns:
+            dict: New scene captions as {scene_number: caption}.
+        """
+        captions = {}
+        if not os.path.exists(self.path):
+            return captions
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self._offset += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                captions[str(record["scene"])] = record["caption"]
+        return captions
+
+    def _open(self):
+        if self._file is None:
+            # Drop a line left half-written by a crash before appending after it
+            if os.path.exists(self.path):
+                with open(self.path, "rb+") as f:
+                    data = f.read()
+                    if data and not data.endswith(b"\n"):
+                        f.truncate(data.rfind(b"\n") + 1)
+            self._file = open(self.path, "ab")
+        return self._file
+
+    def append(self, scene, caption):
+        """
+        Commit the caption of one scene to disk.
+
+        Args:
+            scene (str): Scene number.
+            caption (str): Caption text.
+        """
+        f = self._open()
+        f.write(json.dumps({"scene": str(scene), "caption": caption}).encode() + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
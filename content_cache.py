@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import threading
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentCache:
+    """
+    Size-bounded LRU cache of JSON values stored as files in a local directory.
+
+    Entry files are touched on every hit, so the least recently used entries
+    are the ones with the oldest modification time and are evicted first.
+    """
+
+    def __init__(self, cache_dir=".cache", max_bytes=64 * 1024 * 1024):
+        """
+        Args:
+            cache_dir (str): Directory holding the cache entries.
+            max_bytes (int): Maximum total size of the entries on disk.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._sizes = {
+            file: os.path.getsize(os.path.join(cache_dir, file))
+            for file in os.listdir(cache_dir)
+            if file.endswith(".json")
+        }
+
+    def _file(self, namespace, key):
+        digest = hashlib.sha256(f"{namespace}\0{key}".encode()).hexdigest()
+        return f"{namespace}-{digest}.json"
+
+    def get(self, namespace, key, default=None):
+        """
+        Look up a cached value.
+
+        Args:
+            namespace (str): Kind of value, e.g. "caption" or "gemini".
+            key (str): Content key within the namespace.
+            default: Value returned on a miss.
+        """
+        file = self._file(namespace, key)
+        path = os.path.join(self.cache_dir, file)
+        with self._lock:
+            try:
+                with open(path, "r") as f:
+                    value = json.load(f)
+                os.utime(path)
+            except (OSError, ValueError):
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, namespace, key, value):
+        """Store a JSON-serializable value, evicting least recently used entries if needed."""
+        file = self._file(namespace, key)
+        path = os.path.join(self.cache_dir, file)
+        data = json.dumps(value)
+        with self._lock:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._sizes[file] = len(data)
+            self._evict()
+
+    def _evict(self):
+        total = sum(self._sizes.values())
+        if total <= self.max_bytes:
+            return
+        by_age = sorted(self._sizes, key=lambda f: os.path.getmtime(os.path.join(self.cache_dir, f)))
+        for file in by_age:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, file))
+            except OSError:
+                pass
+            total -= self._sizes.pop(file)
+
+    def stats(self):
+        """Return hit/miss counters and the current number and size of entries."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._sizes),
+            "bytes": sum(self._sizes.values()),
+        }
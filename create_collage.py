@@ -1,9 +1,14 @@
 from PIL import Image
 from search_captions import load_captions, search_captions_advanced
+from generate_captions import load_scene_image
+from profiling import profiler
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import os
 
 
-def create_collage(image_paths, output_file="collage.png", thumbnail_size=(200, 200)):
+def create_collage(image_paths, output_file="collage.png", thumbnail_size=(200, 200), show=True,
+                   thumbnail_cache=None):
     """
     Creates a collage of images and saves it as a single image.
 
@@ -11,6 +16,8 @@ def create_collage(image_paths, output_file="collage.png", thumbnail_size=(200,
         image_paths (list): List of paths to image files to include in the collage.
         output_file (str): Path to save the collage image.
         thumbnail_size (tuple): Size of each thumbnail in the collage (width, height).
+        show (bool): Whether to display the collage after saving it.
+        thumbnail_cache (ThumbnailCache): Optional cache of pre-sized tiles.
     """
     if not image_paths:
         print("No images to create a collage.")
@@ -18,13 +25,18 @@ def create_collage(image_paths, output_file="collage.png", thumbnail_size=(200,
 
     # Create thumbnails for all images
     images = []
-    for image_path in image_paths:
-        try:
-            img = Image.open(image_path)
-            img.thumbnail(thumbnail_size)  # Resize to thumbnail size
-            images.append(img)
-        except Exception as e:
-            print(f"Error loading image {image_path}: {e}")
+    with profiler.stage("collage_load") as record:
+        for image_path in image_paths:
+            try:
+                if thumbnail_cache:
+                    img = thumbnail_cache.get(image_path, thumbnail_size)
+                else:
+                    img = Image.open(image_path)
+                    img.thumbnail(thumbnail_size)  # Resize to thumbnail size
+                images.append(img)
+            except Exception as e:
+                print(f"Error loading image {image_path}: {e}")
+        record["items"] = len(images)
 
     if not images:
         print("No valid images loaded. Cannot create a collage.")
@@ -41,21 +53,115 @@ def create_collage(image_paths, output_file="collage.png", thumbnail_size=(200,
     collage = Image.new("RGB", (collage_width, collage_height), (255, 255, 255))  # White background
 
     # Place images in the collage
-    x_offset = 0
-    y_offset = 0
-    for i, img in enumerate(images):
-        collage.paste(img, (x_offset, y_offset))
-        x_offset += thumbnail_size[0]
-        if (i + 1) % num_cols == 0:  # Move to the next row
-            x_offset = 0
-            y_offset += thumbnail_size[1]
-
-    # Save the collage
-    collage.save(output_file)
+    with profiler.stage("collage_save", items=num_images):
+        x_offset = 0
+        y_offset = 0
+        for i, img in enumerate(images):
+            collage.paste(img, (x_offset, y_offset))
+            x_offset += thumbnail_size[0]
+            if (i + 1) % num_cols == 0:  # Move to the next row
+                x_offset = 0
+                y_offset += thumbnail_size[1]
+
+        # Save the collage
+        collage.save(output_file)
     print(f"Collage saved as {output_file}")
     
     # Display the collage
-    collage.show()
+    if show:
+        collage.show()
+
+
+def _grid_size(num_images):
+    """Returns (columns, rows) of the collage grid, as in create_collage."""
+    num_cols = int(num_images**0.5) + 1
+    num_rows = (num_images // num_cols) + (num_images % num_cols > 0)
+    return num_cols, num_rows
+
+
+def _load_in_order(image_paths, thumbnail_size, workers, thumbnail_cache=None):
+    """
+    Yields (path, thumbnail or None) in input order while workers decode ahead.
+
+    At most 2 * workers thumbnails are decoded ahead of the consumer.
+    """
+    load = thumbnail_cache.get if thumbnail_cache else load_scene_image
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        paths = iter(image_paths)
+        for image_path in paths:
+            pending.append((image_path, executor.submit(load, image_path, thumbnail_size)))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            image_path, future = pending.popleft()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(load, next_path, thumbnail_size)))
+            try:
+                yield image_path, future.result()
+            except Exception as e:
+                print(f"Error loading image {image_path}: {e}")
+                yield image_path, None
+
+
+def create_collage_streaming(image_paths, output_file="collage.png", thumbnail_size=(200, 200), workers=4,
+                             max_per_page=None, show=False, thumbnail_cache=None):
+    """
+    Creates a collage while loading images one at a time, split into pages if needed.
+
+    Thumbnails are decoded by a small pool of workers and collected one page
+    at a time, so memory holds one page of thumbnails instead of every
+    image. Each page's grid is sized from the images that loaded, as in
+    create_collage.
+
+    Args:
+        image_paths (list): List of paths to image files to include in the collage.
+        output_file (str): Path to save the collage image; pages get a _001, _002... suffix.
+        thumbnail_size (tuple): Size of each thumbnail in the collage (width, height).
+        workers (int): Number of threads decoding images.
+        max_per_page (int): Maximum number of images per collage page (None for a single page).
+        show (bool): Whether to display each page after saving it.
+        thumbnail_cache (ThumbnailCache): Optional cache of pre-sized tiles.
+
+    Returns:
+        list: Paths of the saved collage pages.
+    """
+    if not image_paths:
+        print("No images to create a collage.")
+        return []
+
+    page_size = max_per_page or len(image_paths)
+    num_pages = -(-len(image_paths) // page_size)
+    base, ext = os.path.splitext(output_file)
+    images = _load_in_order(image_paths, thumbnail_size, workers, thumbnail_cache)
+
+    saved_pages = []
+    for page in range(num_pages):
+        page_paths = image_paths[page * page_size:(page + 1) * page_size]
+        with profiler.stage("collage_load") as record:
+            thumbnails = [img for _, img in (next(images) for _ in page_paths) if img is not None]
+            record["items"] = len(thumbnails)
+        if not thumbnails:
+            continue
+
+        # Failed images leave no gap, as in create_collage
+        num_cols, num_rows = _grid_size(len(thumbnails))
+        collage = Image.new("RGB", (num_cols * thumbnail_size[0], num_rows * thumbnail_size[1]), (255, 255, 255))
+        for i, img in enumerate(thumbnails):
+            collage.paste(img, ((i % num_cols) * thumbnail_size[0], (i // num_cols) * thumbnail_size[1]))
+
+        page_file = output_file if num_pages == 1 else f"{base}_{page + 1:03d}{ext}"
+        with profiler.stage("collage_save", items=len(thumbnails)):
+            collage.save(page_file)
+        saved_pages.append(page_file)
+        print(f"Collage saved as {page_file}")
+        if show:
+            collage.show()
+
+    if not saved_pages:
+        print("No valid images loaded. Cannot create a collage.")
+    return saved_pages
 
 
 # if __name__ == "__main__":
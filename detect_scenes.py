@@ -1,17 +1,343 @@
+import json
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import cv2
-from scenedetect import SceneManager, open_video
+from scenedetect import FrameTimecode, SceneManager, open_video
 from scenedetect.detectors import ContentDetector
+from profiling import profiler
 
-def detect_and_save_scenes(video_path, output_folder="scene_images", min_scene_length=15, threshold=30.0):
+
+class _KeyframeTap:
+    """
+    Wraps a scenedetect VideoStream and keeps the most recent full-resolution frames.
+
+    SceneManager decodes in a background thread and hands detectors (possibly
+    downscaled) frames a few frames later, so the tap keeps a small window of
+    decoded frames that the cut callback can look up by frame number.
+    """
+
+    def __init__(self, video, buffer_size):
+        self._video = video
+        self._buffer_size = buffer_size
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+        self.first_frame = None
+
+    def __getattr__(self, name):
+        return getattr(self._video, name)
+
+    def read(self, decode=True):
+        frame = self._video.read(decode)
+        if decode and frame is not False:
+            frame_num = self._video.position.frame_num
+            if self.first_frame is None:
+                self.first_frame = (frame_num, frame)
+            with self._lock:
+                self._frames[frame_num] = frame
+                while len(self._frames) > self._buffer_size:
+                    self._frames.popitem(last=False)
+        return frame
+
+    def frame(self, frame_num):
+        """Return the decoded frame with the given number, if still buffered."""
+        with self._lock:
+            return self._frames.get(frame_num)
+
+
+def _scene_image_path(output_folder, scene_number):
+    return os.path.join(output_folder, f"scene_{scene_number}.jpg")
+
+
+def _save_scene_images(video_path, scenes, output_folder, scene_numbers=None, on_scene=None):
+    """Save the first frame of each scene by seeking in the video."""
+    cap = cv2.VideoCapture(video_path)
+    for i, (start_time, _) in enumerate(scenes):
+        if scene_numbers is not None and i + 1 not in scene_numbers:
+            continue
+        cap.set(cv2.CAP_PROP_POS_MSEC, start_time.get_seconds() * 1000)  # Convert to milliseconds
+        success, frame = cap.read()
+        if success:
+            with profiler.stage("save_scene_image", items=1):
+                cv2.imwrite(_scene_image_path(output_folder, i + 1), frame)
+            if on_scene:
+                on_scene(i + 1, _scene_image_path(output_folder, i + 1))
+    cap.release()
+
+
+def _detect_single_pass(video, scene_manager, output_folder, buffer_size, frame_skip=0, on_scene=None):
+    """
+    Run detection and save each scene's first frame as soon as its cut is found.
+
+    Returns:
+        tuple: (number of frames processed, {scene number: frame number} of saved images)
+    """
+    tap = _KeyframeTap(video, buffer_size)
+    cuts = []
+    saved = {}
+
+    def save_keyframe(frame_num, frame, scene_number):
+        if frame is not None:
+            with profiler.stage("save_scene_image", items=1):
+                cv2.imwrite(_scene_image_path(output_folder, scene_number), frame)
+            saved[scene_number] = frame_num
+            if on_scene:
+                on_scene(scene_number, _scene_image_path(output_folder, scene_number))
+
+    def on_cut(_, position):
+        if not cuts:
+            # The first scene starts at the first decoded frame, which has no cut
+            save_keyframe(*tap.first_frame, 1)
+        cuts.append(int(getattr(position, "frame_num", position)))
+        save_keyframe(cuts[-1], tap.frame(cuts[-1]), len(cuts) + 1)
+
+    num_frames = scene_manager.detect_scenes(tap, frame_skip=frame_skip, callback=on_cut)
+    return num_frames, saved
+
+
+def _drop_stale_images(scenes, saved, output_folder):
+    """Remove saved images whose frame does not start the scene with the same number."""
+    starts = [start.frame_num for start, _ in scenes]
+    for scene_number, frame_num in list(saved.items()):
+        if scene_number > len(starts) or starts[scene_number - 1] != frame_num:
+            os.remove(_scene_image_path(output_folder, scene_number))
+            del saved[scene_number]
+    return set(saved)
+
+
+def _set_downscale(scene_manager, downscale):
+    if downscale:
+        scene_manager.auto_downscale = False
+        scene_manager.downscale = downscale
+
+
+def _refine_cuts(video, scenes, threshold, frame_skip, downscale):
+    """
+    Re-run detection at full frame rate just before each cut found with frame skipping.
+
+    A cut reported at a processed frame happened somewhere between the previous
+    processed frame and that one, so only those frame_skip + 1 frames are decoded again.
+    """
+    shifts = {}
+    for start, _ in scenes[1:]:
+        cut = start.frame_num
+        window_start = max(0, cut - frame_skip - 1)
+        scene_manager = SceneManager()
+        _set_downscale(scene_manager, downscale)
+        scene_manager.add_detector(ContentDetector(threshold=threshold, min_scene_len=1))
+        video.seek(window_start)
+        scene_manager.detect_scenes(video, end_time=cut + 1)
+        window_scenes = scene_manager.get_scene_list()
+        if len(window_scenes) > 1:
+            refined = min((s.frame_num for s, _ in window_scenes[1:]), key=lambda f: abs(f - cut))
+            shifts[cut] = refined - cut
+
+    def shift(timecode):
+        delta = shifts.get(timecode.frame_num, 0)
+        return timecode + delta if delta >= 0 else timecode - (-delta)
+
+    return [(shift(start), shift(end)) for start, end in scenes]
+
+
+def _cut_image_path(output_folder, frame_num):
+    return os.path.join(output_folder, f"_cut_{frame_num}.jpg")
+
+
+def _detect_chunk(video_path, output_folder, start_frame, end_frame, overlap, threshold, min_scene_length,
+                  downscale, frame_skip, refine):
+    """
+    Detect cuts in frames [start_frame, end_frame) of a video, in a worker process.
+
+    Detection starts overlap frames early so the detector has warmed up by
+    start_frame; cuts found in the overlap belong to the previous chunk and are
+    dropped. Keyframes of the kept cuts are saved as _cut_<frame>.jpg.
+
+    Returns:
+        list: Cut frame numbers.
+    """
+    video = open_video(video_path)
+    scene_manager = SceneManager()
+    _set_downscale(scene_manager, downscale)
+    detector = ContentDetector(threshold=threshold, min_scene_len=min_scene_length)
+    scene_manager.add_detector(detector)
+    tap = _KeyframeTap(video, getattr(detector, "event_buffer_length", min_scene_length) + 8)
+
+    def on_cut(_, position):
+        frame_num = int(getattr(position, "frame_num", position))
+        frame = tap.frame(frame_num)
+        if start_frame <= frame_num < end_frame and frame is not None:
+            cv2.imwrite(_cut_image_path(output_folder, frame_num), frame)
+
+    video.seek(max(0, start_frame - overlap))
+    scene_manager.detect_scenes(tap, end_time=end_frame, frame_skip=frame_skip, callback=on_cut)
+    if start_frame == 0 and tap.first_frame is not None:
+        cv2.imwrite(_cut_image_path(output_folder, 0), tap.first_frame[1])
+    scenes = scene_manager.get_scene_list()
+    if refine and frame_skip:
+        scenes = _refine_cuts(video, scenes, threshold, frame_skip, downscale)
+    return [start.frame_num for start, _ in scenes[1:] if start_frame <= start.frame_num < end_frame]
+
+
+def _detect_parallel(video_path, output_folder, workers, overlap, threshold, min_scene_length,
+                     downscale, frame_skip, refine, on_scene=None):
+    """
+    Split the video into one time range per worker and detect cuts in a process pool.
+
+    Returns:
+        tuple: (scene list, number of frames processed)
+    """
+    video = open_video(video_path)
+    total_frames = video.duration.frame_num
+    frame_rate = video.frame_rate
+    chunk_length = -(-total_frames // workers)
+    bounds = [(start, min(start + chunk_length, total_frames)) for start in range(0, total_frames, chunk_length)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_detect_chunk, video_path, output_folder, start, end, overlap, threshold,
+                            min_scene_length, downscale, frame_skip, refine)
+            for start, end in bounds
+        ]
+        results = [future.result() for future in futures]
+
+    # Merge the chunk cut lists, dropping cuts found by two chunks a few frames apart
+    cuts = []
+    for cut in sorted(cut for chunk_cuts in results for cut in chunk_cuts):
+        if cuts and cut - cuts[-1] < min_scene_length:
+            continue
+        cuts.append(cut)
+    # Overlap frames are decoded twice but belong to one chunk only
+    num_frames = sum(end - start for start, end in bounds)
+
+    if not cuts:
+        return [], num_frames
+    starts = [0] + cuts
+    ends = cuts + [total_frames]
+    scenes = [
+        (FrameTimecode(start, fps=frame_rate), FrameTimecode(end, fps=frame_rate))
+        for start, end in zip(starts, ends)
+    ]
+
+    # Give the keyframes saved by the workers their scene numbers
+    missing = set()
+    for i, start in enumerate(starts):
+        cut_path = _cut_image_path(output_folder, start)
+        if os.path.exists(cut_path):
+            os.replace(cut_path, _scene_image_path(output_folder, i + 1))
+            if on_scene:
+                on_scene(i + 1, _scene_image_path(output_folder, i + 1))
+        else:
+            missing.add(i + 1)
+    for file in os.listdir(output_folder):
+        if file.startswith("_cut_"):
+            os.remove(os.path.join(output_folder, file))
+    if missing:
+        _save_scene_images(video_path, scenes, output_folder, missing, on_scene)
+    return scenes, num_frames
+
+
+def format_timestamp(seconds):
+    """Format seconds as HH:MM:SS."""
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def _video_version(video_path):
+    """Return [size, mtime_ns] of a video, which identify it without reading it."""
+    stat = os.stat(video_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def save_scene_timeline(scenes, timeline_file, video_path=None):
+    """
+    Saves the start and end of each scene as JSON.
+
+    Args:
+        scenes (list): Scene list as returned by detect_and_save_scenes.
+        timeline_file (str): Path of the JSON file to write.
+        video_path (str): Optional video the scenes were detected in; its size and mtime are stored with them.
+    """
+    timeline = {
+        str(i + 1): {
+            "start_frame": start.frame_num,
+            "end_frame": end.frame_num,
+            "start": float(start.get_seconds()),
+            "end": float(end.get_seconds()),
+        }
+        for i, (start, end) in enumerate(scenes)
+    }
+    with open(timeline_file, "w") as f:
+        json.dump({"video": _video_version(video_path) if video_path else None, "scenes": timeline}, f)
+
+
+def load_scene_timeline(timeline_file, video_path=None):
+    """
+    Loads a scene timeline saved by save_scene_timeline.
+
+    Args:
+        timeline_file (str): Path of the JSON file.
+        video_path (str): Optional video the timeline must have been detected in.
+
+    Returns:
+        dict: {scene_number: {"start_frame", "end_frame", "start", "end"}}, empty if the file is
+            missing or belongs to another video.
+    """
+    if not os.path.exists(timeline_file):
+        return {}
+    with open(timeline_file, "r") as f:
+        timeline = json.load(f)
+    if video_path and timeline["video"] != _video_version(video_path):
+        return {}
+    return timeline["scenes"]
+
+
+def timeline_path_for(output_folder):
+    """Return the path of the scene timeline saved alongside the scene images folder."""
+    return f"{os.path.normpath(output_folder)}.timeline.json"
+
+
+def scene_at(timeline, seconds):
+    """
+    Finds the scene playing at a point in time.
+
+    Args:
+        timeline (dict): Scene timeline as returned by load_scene_timeline.
+        seconds (float): Time in the video.
+
+    Returns:
+        str: Scene number, or None if the time is outside every scene.
+    """
+    for scene, times in timeline.items():
+        if times["start"] <= seconds < times["end"]:
+            return scene
+    return None
+
+
+def detect_and_save_scenes(video_path, output_folder="scene_images", min_scene_length=15, threshold=30.0,
+                           single_pass=False, downscale=None, frame_skip=0, refine=False, workers=1, overlap=None,
+                           on_scene=None, thumbnail_cache=None, thumbnail_size=(200, 200)):
     """
     Detects scenes in a video and saves scene images to a folder.
 
     Args:
         video_path (str): Path to the video file.
         output_folder (str): Path to save scene images.
-        min_scene_length (int): Minimum scene length in seconds.
+        min_scene_length (int): Minimum scene length in frames.
         threshold (float): Sensitivity of scene detection.
+        single_pass (bool): Capture scene images during detection so the video is decoded only once.
+        downscale (int): Factor to shrink frames by before detection (None picks one from the resolution).
+        frame_skip (int): Number of frames skipped after each processed frame (0 processes every frame).
+        refine (bool): Re-check each cut at full frame rate when frame_skip is used.
+        workers (int): Number of processes detecting separate time ranges of the video in parallel.
+        overlap (int): Frames each range starts early to warm up the detector (default 2 * min_scene_length).
+        on_scene (callable): Called as on_scene(scene_number, image_path) after each scene image is saved.
+            In single-pass mode this happens while detection is still running.
+        thumbnail_cache (ThumbnailCache): Optional cache filled with a collage tile of each saved scene image.
+        thumbnail_size (tuple): Size of the cached collage tiles (width, height).
+
+    The start and end of every scene are also saved next to output_folder, see timeline_path_for.
 
     Returns:
         list: A list of scenes as (start_time, end_time).
@@ -20,22 +346,61 @@ def detect_and_save_scenes(video_path, output_folder="scene_images", min_scene_l
         if not os.path.exists(output_folder):
             os.makedirs(output_folder)
 
+        if thumbnail_cache:
+            # Produce collage tiles while the scene images are still hot in the page cache
+            report_scene = on_scene
+
+            def on_scene(scene_number, image_path):
+                thumbnail_cache.put(image_path, thumbnail_size)
+                if report_scene:
+                    report_scene(scene_number, image_path)
+
+        start = time.perf_counter()
+        if workers > 1:
+            overlap = 2 * min_scene_length if overlap is None else overlap
+            with profiler.stage("detect_scenes") as record:
+                scenes, num_frames = _detect_parallel(video_path, output_folder, workers, overlap, threshold,
+                                                      min_scene_length, downscale, frame_skip, refine, on_scene)
+                record["items"] = num_frames
+            save_scene_timeline(scenes, timeline_path_for(output_folder), video_path)
+            elapsed = time.perf_counter() - start
+            print(f"Saved {len(scenes)} scene images to {output_folder}.")
+            print(f"Processed {num_frames} frames with {workers} workers in {elapsed:.1f}s "
+                  f"({num_frames / max(elapsed, 1e-9):.1f} fps).")
+            return scenes
+
         video = open_video(video_path)
         scene_manager = SceneManager()
-        scene_manager.add_detector(ContentDetector(threshold=threshold, min_scene_len=min_scene_length))
-        scene_manager.detect_scenes(video)
+        _set_downscale(scene_manager, downscale)
+        detector = ContentDetector(threshold=threshold, min_scene_len=min_scene_length)
+        scene_manager.add_detector(detector)
+
+        with profiler.stage("detect_scenes") as record:
+            if single_pass:
+                # Cuts can be reported up to event_buffer_length frames late, plus the decode queue
+                buffer_size = getattr(detector, "event_buffer_length", min_scene_length) + 8
+                num_frames, saved = _detect_single_pass(video, scene_manager, output_folder, buffer_size,
+                                                        frame_skip, on_scene)
+            else:
+                num_frames = scene_manager.detect_scenes(video, frame_skip=frame_skip)
+            record["items"] = num_frames
         scenes = scene_manager.get_scene_list()
+        if refine and frame_skip:
+            with profiler.stage("refine_cuts", items=len(scenes)):
+                scenes = _refine_cuts(video, scenes, threshold, frame_skip, downscale)
+
+        if single_pass:
+            missing = {i + 1 for i in range(len(scenes))} - _drop_stale_images(scenes, saved, output_folder)
+            if missing:
+                # Cuts emitted after the last frame or moved by refinement are saved by seeking
+                _save_scene_images(video_path, scenes, output_folder, missing, on_scene)
+        else:
+            _save_scene_images(video_path, scenes, output_folder, on_scene=on_scene)
+        save_scene_timeline(scenes, timeline_path_for(output_folder), video_path)
+        elapsed = time.perf_counter() - start
 
-        cap = cv2.VideoCapture(video_path)
-        for i, (start_time, _) in enumerate(scenes):
-            cap.set(cv2.CAP_PROP_POS_MSEC, start_time.get_seconds() * 1000)  # Convert to milliseconds
-            success, frame = cap.read()
-            if success:
-                image_path = os.path.join(output_folder, f"scene_{i + 1}.jpg")
-                cv2.imwrite(image_path, frame)
-        
-        cap.release()
         print(f"Saved {len(scenes)} scene images to {output_folder}.")
+        print(f"Processed {num_frames} frames in {elapsed:.1f}s ({num_frames / max(elapsed, 1e-9):.1f} fps).")
         return scenes
     except Exception as e:
         raise RuntimeError(f"Failed to detect and save scenes: {e}")
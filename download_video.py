@@ -1,25 +1,60 @@
+import os
 from yt_dlp import YoutubeDL
+from media_cache import format_for_height
+from profiling import profiler
 
-def download_video(query, output_file="video.mp4"):
+def download_video(query, output_file="video.mp4", max_height=None):
     """
     Downloads a video based on the given query using yt-dlp's Python API.
 
     Args:
         query (str): Search query for the video.
         output_file (str): The output file name for the downloaded video.
+        max_height (int): Optional cap on the video resolution, e.g. 480.
 
     Returns:
         str: Path to the downloaded video file.
     """
     try:
         ydl_opts = {
-            'format': 'best',
+            'format': format_for_height(max_height),
             'outtmpl': output_file,  # Output template for the file
             'quiet': True,  # Suppress yt-dlp logs
         }
-        with YoutubeDL(ydl_opts) as ydl:
+        with profiler.stage("download") as record, YoutubeDL(ydl_opts) as ydl:
             ydl.download([f"ytsearch:{query}"])
+            if os.path.exists(output_file):
+                record["items"] = os.path.getsize(output_file)  # Throughput in bytes per second
         return output_file
     except Exception as e:
         raise RuntimeError(f"Failed to download video: {e}")
-    
+
+
+class YtDlpDownloader:
+    """MediaCache downloader for search queries and page URLs supported by yt-dlp."""
+
+    def resolve(self, source):
+        """Look up the video a query or URL refers to without downloading it."""
+        target = source if "://" in source else f"ytsearch1:{source}"
+        with YoutubeDL({'quiet': True, 'skip_download': True}) as ydl:
+            info = ydl.extract_info(target, download=False, process=False)
+            if info.get("_type") in ("playlist", "url"):
+                entries = list(info.get("entries") or [info])
+                info = ydl.extract_info(entries[0].get("url") or entries[0]["id"], download=False, process=False)
+        return {
+            "id": f"{info.get('extractor_key', 'video').lower()}-{info['id']}",
+            "title": info.get("title"),
+            "url": info.get("webpage_url") or target,
+        }
+
+    def download(self, info, output_path, max_height=None):
+        """Download a resolved video; yt-dlp resumes its own .part file."""
+        ydl_opts = {
+            'format': format_for_height(max_height),
+            'outtmpl': output_path,
+            'continuedl': True,  # Resume <output_path>.part after an interruption
+            'quiet': True,
+        }
+        with YoutubeDL(ydl_opts) as ydl:
+            result = ydl.extract_info(info["url"], download=True)
+        return {"height": result.get("height"), "format_id": result.get("format_id")}
@@ -0,0 +1,279 @@
+import hashlib
+import os
+import numpy as np
+
+_KINDS = ("caption", "image")
+
+
+def _normalize(vectors):
+    """Return float32 rows scaled to unit length (zero rows stay zero)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.ascontiguousarray(vectors / np.maximum(norms, 1e-12))
+
+
+def _digest(caption):
+    return hashlib.sha1(caption.encode()).hexdigest()[:16]
+
+
+class SentenceEncoder:
+    """
+    Local CPU embedding model from sentence-transformers.
+
+    Text models such as all-MiniLM-L6-v2 embed captions and queries; CLIP
+    models such as clip-ViT-B-32 also embed keyframe images into the same
+    space. The model is loaded on first use.
+    """
+
+    def __init__(self, model_name="all-MiniLM-L6-v2", device="cpu", batch_size=64):
+        """
+        Args:
+            model_name (str): sentence-transformers model name or path.
+            device (str): Torch device the model runs on.
+            batch_size (int): Number of inputs encoded together.
+        """
+        self.model_name = model_name
+        self.device = device
+        self.batch_size = batch_size
+        self._model = None
+
+    def _load(self):
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+
+            print(f"Loading embedding model {self.model_name}...")
+            self._model = SentenceTransformer(self.model_name, device=self.device)
+        return self._model
+
+    def encode_text(self, texts):
+        """Return a (len(texts), dim) matrix of text embeddings."""
+        return self._load().encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True)
+
+    def encode_images(self, image_paths):
+        """Return a (len(image_paths), dim) matrix of image embeddings."""
+        from PIL import Image
+
+        images = [Image.open(path).convert("RGB") for path in image_paths]
+        return self._load().encode(images, batch_size=self.batch_size, convert_to_numpy=True)
+
+
+class EmbeddingIndex:
+    """
+    Dense vector index over scene captions and keyframes.
+
+    All vectors live in one contiguous, L2-normalized float32 matrix, so a
+    batch of queries is scored with a single matrix product. A scene may have
+    several rows (its caption and its keyframe); it is ranked by its best
+    row. An optional random-hyperplane LSH index restricts scoring to the
+    rows sharing a bucket with the query, for libraries too large to scan.
+    A digest of each embedded caption is kept so changed captions can be
+    found and embedded again.
+    """
+
+    def __init__(self):
+        self.scenes = []
+        self.kinds = np.zeros(0, dtype=np.uint8)
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.caption_digests = {}
+        self._lsh = None
+
+    def __len__(self):
+        return len(set(self.scenes))
+
+    def add(self, scenes, vectors, kind="caption"):
+        """
+        Add one vector per scene.
+
+        Args:
+            scenes (list): Scene numbers.
+            vectors (array): Matrix with one row per scene.
+            kind (str): "caption" or "image".
+        """
+        if not len(scenes):
+            return
+        vectors = _normalize(vectors)
+        if not len(self.scenes):
+            self.vectors = vectors
+        else:
+            self.vectors = np.ascontiguousarray(np.vstack([self.vectors, vectors]))
+        self.scenes.extend(str(scene) for scene in scenes)
+        self.kinds = np.concatenate([self.kinds, np.full(len(scenes), _KINDS.index(kind), dtype=np.uint8)])
+        self._lsh = None
+
+    def remove(self, scenes, kind=None):
+        """
+        Remove the vectors of some scenes.
+
+        Args:
+            scenes (list): Scene numbers.
+            kind (str): Only remove rows of this kind ("caption" or "image"), or all rows if None.
+        """
+        scenes = {str(scene) for scene in scenes}
+        if not scenes or not len(self.scenes):
+            return
+        keep = np.array([scene not in scenes for scene in self.scenes])
+        if kind is not None:
+            keep |= self.kinds != _KINDS.index(kind)
+        self.vectors = np.ascontiguousarray(self.vectors[keep])
+        self.scenes = [scene for scene, kept in zip(self.scenes, keep.tolist()) if kept]
+        self.kinds = self.kinds[keep]
+        if kind in (None, "caption"):
+            for scene in scenes:
+                self.caption_digests.pop(scene, None)
+        self._lsh = None
+
+    def build_approximate(self, num_bits=12, num_tables=4, seed=0):
+        """
+        Build the LSH index used by search(approximate=True).
+
+        Args:
+            num_bits (int): Hyperplanes per table; more bits give smaller buckets.
+            num_tables (int): Independent tables; more tables give better recall.
+            seed (int): Seed of the random hyperplanes.
+        """
+        rng = np.random.default_rng(seed)
+        planes = rng.standard_normal((num_tables, num_bits, self.vectors.shape[1])).astype(np.float32)
+        weights = 1 << np.arange(num_bits)
+        tables = []
+        for table_planes in planes:
+            codes = (self.vectors @ table_planes.T > 0) @ weights
+            order = np.argsort(codes, kind="stable")
+            keys, starts = np.unique(codes[order], return_index=True)
+            bounds = np.append(starts, len(order))
+            tables.append({int(key): order[bounds[i]:bounds[i + 1]] for i, key in enumerate(keys)})
+        self._lsh = (planes, weights, tables)
+
+    def _candidates(self, query):
+        planes, weights, tables = self._lsh
+        codes = (planes @ query > 0) @ weights
+        rows = [table.get(int(code)) for table, code in zip(tables, codes)]
+        rows = [r for r in rows if r is not None]
+        return np.unique(np.concatenate(rows)) if rows else np.zeros(0, dtype=np.int64)
+
+    def _rank(self, rows, scores, limit, min_score):
+        """Keep the best row per scene and return the top scenes."""
+        best = {}
+        for row, score in zip(rows.tolist(), scores.tolist()):
+            scene = self.scenes[row]
+            if score > best.get(scene, -np.inf):
+                best[scene] = score
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        if min_score is not None:
+            ranked = [(scene, score) for scene, score in ranked if score >= min_score]
+        return ranked[:limit] if limit is not None else ranked
+
+    def search(self, query_vectors, limit=10, min_score=None, approximate=False):
+        """
+        Rank scenes for a batch of query vectors by cosine similarity.
+
+        Args:
+            query_vectors (array): Matrix with one row per query.
+            limit (int): Maximum number of results per query (None for all).
+            min_score (float): Optional minimum cosine similarity.
+            approximate (bool): Only score rows in the query's LSH buckets.
+
+        Returns:
+            list: One list of (scene, score) tuples per query, best match first.
+        """
+        queries = _normalize(np.atleast_2d(query_vectors))
+        if not len(self.scenes):
+            return [[] for _ in queries]
+        if approximate:
+            if self._lsh is None:
+                self.build_approximate()
+            results = []
+            for query in queries:
+                rows = self._candidates(query)
+                results.append(self._rank(rows, self.vectors[rows] @ query, limit, min_score))
+            return results
+
+        scores = queries @ self.vectors.T
+        # Only the best rows can hold the top scenes; a scene has at most len(_KINDS) rows
+        k = scores.shape[1] if limit is None else min(scores.shape[1], limit * len(_KINDS))
+        top = np.sort(np.argpartition(-scores, k - 1, axis=1)[:, :k], axis=1)  # Ties keep insertion order
+        return [self._rank(rows, row_scores[rows], limit, min_score) for rows, row_scores in zip(top, scores)]
+
+    def search_text(self, encoder, queries, limit=10, min_score=None, approximate=False):
+        """Encode text queries with encoder and search them in one batch."""
+        return self.search(encoder.encode_text(queries), limit, min_score, approximate)
+
+    def save(self, embeddings_file):
+        """Save the index to an .npz file, replacing it atomically."""
+        tmp_file = f"{embeddings_file}.tmp"
+        with open(tmp_file, "wb") as f:
+            np.savez(
+                f, vectors=self.vectors, scenes=np.array(self.scenes, dtype=str), kinds=self.kinds,
+                digest_scenes=np.array(list(self.caption_digests), dtype=str),
+                digests=np.array(list(self.caption_digests.values()), dtype=str),
+            )
+        os.replace(tmp_file, embeddings_file)
+
+    @classmethod
+    def load(cls, embeddings_file):
+        """Load an index saved with :meth:`save`."""
+        with np.load(embeddings_file) as data:
+            index = cls()
+            index.vectors = np.ascontiguousarray(data["vectors"], dtype=np.float32)
+            index.scenes = data["scenes"].tolist()
+            index.kinds = data["kinds"]
+            # Files saved without digests are embedded again by the next update
+            if "digests" in data.files:
+                index.caption_digests = dict(zip(data["digest_scenes"].tolist(), data["digests"].tolist()))
+        return index
+
+
+class CaptionEmbedder:
+    """Keeps the embeddings file of a video in step with its captions and keyframes."""
+
+    def __init__(self, embeddings_file, encoder, scene_images_folder=None):
+        """
+        Args:
+            embeddings_file (str): Path of the embeddings .npz file.
+            encoder (SentenceEncoder): Encoder with encode_text (and encode_images for keyframes).
+            scene_images_folder (str): Optional folder of keyframes to embed as well; needs an
+                encoder that embeds images, such as a CLIP model.
+        """
+        self.embeddings_file = embeddings_file
+        self.encoder = encoder
+        self.scene_images_folder = scene_images_folder
+
+    def update(self, captions):
+        """
+        Embed the captions (and keyframes) of scenes that have no vectors yet,
+        embed changed captions again and drop scenes that no longer have a caption.
+
+        Args:
+            captions (dict): Scene captions as {scene_number: caption}.
+
+        Returns:
+            EmbeddingIndex: The up-to-date index.
+        """
+        exists = os.path.exists(self.embeddings_file)
+        index = EmbeddingIndex.load(self.embeddings_file) if exists else EmbeddingIndex()
+        captions = {str(scene): caption for scene, caption in captions.items()}
+
+        removed = set(index.scenes) - set(captions)
+        index.remove(removed)
+        missing = [scene for scene in captions if index.caption_digests.get(scene) != _digest(captions[scene])]
+        if missing:
+            print(f"Embedding {len(missing)} captions...")
+            index.remove(missing, kind="caption")
+            index.add(missing, self.encoder.encode_text([captions[scene] for scene in missing]))
+            index.caption_digests.update((scene, _digest(captions[scene])) for scene in missing)
+        embedded = set(zip(index.scenes, index.kinds.tolist()))
+
+        missing_images = []
+        if self.scene_images_folder:
+            missing_images = [
+                scene for scene in captions
+                if (str(scene), 1) not in embedded
+                and os.path.exists(os.path.join(self.scene_images_folder, f"scene_{scene}.jpg"))
+            ]
+            if missing_images:
+                print(f"Embedding {len(missing_images)} keyframes...")
+                paths = [os.path.join(self.scene_images_folder, f"scene_{scene}.jpg") for scene in missing_images]
+                index.add(missing_images, self.encoder.encode_images(paths), kind="image")
+
+        if removed or missing or missing_images or not exists:
+            index.save(self.embeddings_file)
+        return index
@@ -1,17 +1,35 @@
+import asyncio
 import os
 import re
 import time
 import google.generativeai as genai
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from content_cache import file_hash
+from profiling import profiler
 
-# Configure the Gemini API
-genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+_configured = False
+
+
+def configure_gemini():
+    """Configures the Gemini API from GEMINI_API_KEY on first use."""
+    global _configured
+    if _configured:
+        return
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        raise RuntimeError("GEMINI_API_KEY is not set. Export it to use the video model (Gemini).")
+    genai.configure(api_key=api_key)
+    _configured = True
 
 
 def upload_to_gemini(path, mime_type=None):
     """Uploads the given file to Gemini."""
+    configure_gemini()
     print("Uploading video to Gemini API...")
-    file = genai.upload_file(path, mime_type=mime_type)
+    with profiler.stage("gemini_upload", items=os.path.getsize(path)):
+        file = genai.upload_file(path, mime_type=mime_type)
     print(f"Uploaded file '{file.display_name}' as: {file.uri}")
     return file
 
@@ -19,31 +37,55 @@ def wait_for_files_active(files):
     """Waits for the given files to be active."""
     print("Waiting for file processing...")
     for name in (file.name for file in files):
-        file = genai.get_file(name)
-        while file.state.name == "PROCESSING":
-            print(".", end="", flush=True)
-            time.sleep(10)
+        with profiler.stage("gemini_processing_wait", items=1):
             file = genai.get_file(name)
+            while file.state.name == "PROCESSING":
+                print(".", end="", flush=True)
+                time.sleep(10)
+                file = genai.get_file(name)
         if file.state.name != "ACTIVE":
             raise Exception(f"File {file.name} failed to process")
     print("...all files ready")
     print()
 
-def search_in_gemini(video_path, user_query):
-    """Uses Gemini API to find timestamps matching the user query in the video."""
+def search_in_gemini(video_path, user_query, cache=None):
+    """
+    Uses Gemini API to find timestamps matching the user query in the video.
+
+    If a ContentCache is given, answers are cached by video content hash and query.
+    """
+    if cache:
+        cache_key = f"{file_hash(video_path)}\0{user_query}"
+        matches_time = cache.get("gemini", cache_key)
+        if matches_time is not None:
+            print(f"Found cached timestamps: {matches_time}")
+            profiler.count("gemini_cache_hits")
+            return matches_time
+
     # Upload video to Gemini
     files = [upload_to_gemini(video_path, mime_type="video/mp4")]
     wait_for_files_active(files)
 
+    matches_time = ask_gemini(files[0], user_query)
+
+    if cache:
+        cache.set("gemini", cache_key, matches_time)
+    return matches_time
+
+
+GENERATION_CONFIG = {
+    "temperature": 0,
+    "top_p": 0.95,
+    "top_k": 64,
+    "max_output_tokens": 8192,
+    "response_mime_type": "text/plain",
+}
+
+
+def ask_gemini(file, user_query, model_name="gemini-1.5-flash"):
+    """Asks Gemini for the timestamps matching the user query in an uploaded, active video file."""
     # Start a chat session
-    generation_config = {
-        "temperature": 0,
-        "top_p": 0.95,
-        "top_k": 64,
-        "max_output_tokens": 8192,
-        "response_mime_type": "text/plain",
-    }
-    model = genai.GenerativeModel(model_name="gemini-1.5-flash", generation_config=generation_config)
+    model = genai.GenerativeModel(model_name=model_name, generation_config=GENERATION_CONFIG)
     chat_session = model.start_chat(history=[])
 
     # Send the query to Gemini
@@ -51,17 +93,286 @@ def search_in_gemini(video_path, user_query):
         "role": "user",
         "parts": [
             f"This is the video. Give me the timestamps of all frames where you see '{user_query}' in the video.",
-            files[0],
+            file,
         ],
     }
-    response = chat_session.send_message(prompt)
+    with profiler.stage("gemini_query", items=1):
+        response = chat_session.send_message(prompt)
     print(f"Received response to check: {response.text}")
-    
+
     # Extract timestamps from response
     pattern = r"(\d{1,2}:\d{2}:\d{2})"
     matches_time = re.findall(pattern, response.text)
     print(f"Found timestamps: {matches_time}")
+    return matches_time
+
+
+class GeminiSession:
+    """
+    Asyncio Gemini client that uploads each video once and answers many queries concurrently.
+
+    Uploaded files are remembered by the video's content hash until they
+    expire; the hash is computed once per version (path, size and mtime) of
+    a file, so repeated queries never re-read the video. Processing is
+    polled with exponential backoff, and at most max_concurrency queries are
+    in flight at once. The blocking genai calls run in worker threads.
+    """
+
+    def __init__(self, model_name="gemini-1.5-flash", max_concurrency=4, poll_initial=1.0, poll_max=30.0,
+                 upload_ttl=47 * 3600):
+        """
+        Args:
+            model_name (str): Gemini model used for queries.
+            max_concurrency (int): Maximum number of queries sent at the same time.
+            poll_initial (float): First delay in seconds while waiting for an upload to be processed.
+            poll_max (float): Longest delay between two processing checks.
+            upload_ttl (float): Seconds an upload is reused when the file reports no expiration time.
+        """
+        self.model_name = model_name
+        self.max_concurrency = max_concurrency
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self.upload_ttl = upload_ttl
+        self.uploads = 0
+        self._files = {}
+        self._hashes = {}
+        self._hash_tasks = {}
+        self._upload_locks = {}
+        self._semaphore = None
+        self._loop = None
+
+    def _bind_loop(self):
+        # Locks and semaphores belong to one event loop; uploads stay cached across loops
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._hash_tasks = {}
+            self._upload_locks = {}
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def _expires_at(self, file):
+        expiration_time = getattr(file, "expiration_time", None)
+        if expiration_time is not None:
+            return expiration_time.timestamp()
+        return time.time() + self.upload_ttl
+
+    async def _wait_active(self, file):
+        delay = self.poll_initial
+        with profiler.stage("gemini_processing_wait", items=1):
+            while file.state.name == "PROCESSING":
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.poll_max)
+                file = await asyncio.to_thread(genai.get_file, file.name)
+        if file.state.name != "ACTIVE":
+            raise Exception(f"File {file.name} failed to process")
+        return file
+
+    async def _content_key(self, video_path):
+        """Return the content hash of a video, reading each version of the file only once."""
+        stat = os.stat(video_path)
+        version = (os.path.realpath(video_path), stat.st_size, stat.st_mtime_ns)
+        if version not in self._hashes:
+            # Concurrent queries on a new file share one hashing task
+            task = self._hash_tasks.get(version)
+            if task is None:
+                task = self._hash_tasks[version] = asyncio.ensure_future(asyncio.to_thread(file_hash, video_path))
+            try:
+                self._hashes[version] = await task
+            finally:
+                self._hash_tasks.pop(version, None)
+        return self._hashes[version]
+
+    async def upload(self, video_path):
+        """
+        Returns an active uploaded file for the video, uploading it only if needed.
+
+        Args:
+            video_path (str): Path to the video file.
+        """
+        self._bind_loop()
+        key = await self._content_key(video_path)
+        lock = self._upload_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            cached = self._files.get(key)
+            # Keep a minute of margin so a query never races the expiration
+            if cached and cached[1] - 60 > time.time():
+                return cached[0]
+            file = await asyncio.to_thread(upload_to_gemini, video_path, "video/mp4")
+            self.uploads += 1
+            file = await self._wait_active(file)
+            self._files[key] = (file, self._expires_at(file))
+            return file
+
+    async def ask(self, video_path, user_query):
+        """
+        Returns the timestamps matching one query in the video.
+
+        Args:
+            video_path (str): Path to the video file.
+            user_query (str): What to look for in the video.
+        """
+        file = await self.upload(video_path)
+        async with self._semaphore:
+            return await asyncio.to_thread(ask_gemini, file, user_query, self.model_name)
+
+    async def ask_many(self, video_path, user_queries):
+        """
+        Answers several queries about the same video concurrently.
+
+        Returns:
+            dict: Timestamps for each query as {user_query: [HH:MM:SS, ...]}.
+        """
+        results = await asyncio.gather(*(self.ask(video_path, query) for query in user_queries))
+        return dict(zip(user_queries, results))
+
+    async def ask_sharded(self, segments, user_query, merge_seconds=1.0):
+        """
+        Answers one query over the segments of a video concurrently.
+
+        Args:
+            segments (list): (segment_path, start_seconds) pairs as returned by split_video.
+            user_query (str): What to look for in the video.
+            merge_seconds (float): Matches closer than this are merged into one.
+
+        Returns:
+            list: Timestamps in the whole video as HH:MM:SS, in order.
+        """
+        results = await asyncio.gather(*(self.ask(path, user_query) for path, _ in segments))
+        matches = [
+            start + timestamp_to_seconds(timestamp)
+            for (_, start), timestamps in zip(segments, results)
+            for timestamp in timestamps
+        ]
+        return merge_timestamps(matches, merge_seconds)
+
+
+def search_many_in_gemini(video_path, user_queries, max_concurrency=4):
+    """Uploads the video once and answers all queries concurrently."""
+    return asyncio.run(GeminiSession(max_concurrency=max_concurrency).ask_many(video_path, user_queries))
+
+
+def seconds_to_timestamp(seconds):
+    """Formats seconds as HH:MM:SS."""
+    seconds = int(round(seconds))
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def merge_timestamps(seconds, merge_seconds=1.0):
+    """
+    Sorts matches and merges the ones closer than merge_seconds, e.g. around segment boundaries.
 
+    Args:
+        seconds (list): Match times in seconds.
+        merge_seconds (float): Matches closer than this to the previous kept match are dropped.
+
+    Returns:
+        list: Timestamps as HH:MM:SS.
+    """
+    kept = []
+    for second in sorted(seconds):
+        if not kept or second - kept[-1] >= merge_seconds:
+            kept.append(second)
+    timestamps = []
+    for second in kept:
+        timestamp = seconds_to_timestamp(second)
+        if not timestamps or timestamps[-1] != timestamp:
+            timestamps.append(timestamp)
+    return timestamps
+
+
+def video_duration(video_path):
+    """Returns the duration of a video in seconds (0 if unknown)."""
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    cap.release()
+    return frames / fps if fps else 0.0
+
+
+def split_video(video_path, segment_folder, segment_seconds=600):
+    """
+    Splits a video into segments with ffmpeg stream copy, without re-encoding.
+
+    Stream copy can only cut on keyframes, so segments start near, not at,
+    multiples of segment_seconds; their real start times are read from the
+    segment list ffmpeg writes. Segments are kept in a sub-folder named by
+    the video's content hash, so they are only ever reused for the same video.
+
+    Args:
+        video_path (str): Path to the video file.
+        segment_folder (str): Folder holding the segments of every video.
+        segment_seconds (float): Target length of each segment.
+
+    Returns:
+        list: (segment_path, start_seconds) pairs in order.
+    """
+    segment_folder = os.path.join(segment_folder, file_hash(video_path)[:16])
+    list_file = os.path.join(segment_folder, f"segments_{segment_seconds:g}.csv")
+    if not os.path.exists(list_file):
+        os.makedirs(segment_folder, exist_ok=True)
+        # ffmpeg writes the list as it goes; it only counts once the split succeeded
+        tmp_list_file = f"{list_file}.tmp"
+        command = [
+            "ffmpeg", "-y", "-i", video_path,
+            "-map", "0", "-c", "copy",
+            "-f", "segment", "-segment_time", str(segment_seconds), "-reset_timestamps", "1",
+            "-segment_list", tmp_list_file, "-segment_list_type", "csv",
+            os.path.join(segment_folder, f"segment_{segment_seconds:g}_%03d.mp4"),
+        ]
+        try:
+            with profiler.stage("split_video"):
+                subprocess.run(command, check=True, capture_output=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise RuntimeError(f"Failed to split video: {e}")
+        os.replace(tmp_list_file, list_file)
+
+    segments = []
+    with open(list_file, "r") as f:
+        for line in f:
+            if line.strip():
+                name, start, _ = line.strip().rsplit(",", 2)
+                segments.append((os.path.join(segment_folder, name), float(start)))
+    return segments
+
+
+def search_in_gemini_sharded(video_path, user_query, segment_seconds=600, max_concurrency=4,
+                             segment_folder="gemini_segments", splitter=split_video, cache=None):
+    """
+    Uses Gemini API to find timestamps in a long video, one segment at a time.
+
+    The video is split into segments that are uploaded and queried
+    concurrently; each segment's timestamps are shifted by the segment's
+    start and the matches of all segments are merged.
+
+    Args:
+        video_path (str): Path to the video file.
+        user_query (str): What to look for in the video.
+        segment_seconds (float): Target length of each segment.
+        max_concurrency (int): Maximum number of queries sent at the same time.
+        segment_folder (str): Folder to write the segments in.
+        splitter (callable): splitter(video_path, segment_folder, segment_seconds) returning
+            (segment_path, start_seconds) pairs; split_video by default.
+        cache (ContentCache): Optional cache of answers by video content hash and query.
+
+    Returns:
+        list: Timestamps in the whole video as HH:MM:SS.
+    """
+    if cache:
+        cache_key = f"{file_hash(video_path)}\0{user_query}\0{segment_seconds:g}"
+        matches_time = cache.get("gemini", cache_key)
+        if matches_time is not None:
+            print(f"Found cached timestamps: {matches_time}")
+            profiler.count("gemini_cache_hits")
+            return matches_time
+
+    segments = splitter(video_path, segment_folder, segment_seconds)
+    print(f"Searching {len(segments)} segments of {video_path} concurrently...")
+    session = GeminiSession(max_concurrency=max_concurrency)
+    matches_time = asyncio.run(session.ask_sharded(segments, user_query))
+    print(f"Found timestamps: {matches_time}")
+
+    if cache:
+        cache.set("gemini", cache_key, matches_time)
     return matches_time
 
 
@@ -85,3 +396,113 @@ def extract_frames(matches_time, frame_folder, video_path):
             print(f"Error extracting frame at {timestamp}: {e}")
     return extracted_frames
 
+
+def timestamp_to_seconds(timestamp):
+    """Converts an HH:MM:SS (or MM:SS, or seconds) timestamp to seconds."""
+    seconds = 0.0
+    for part in str(timestamp).split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def extract_frames_batch(matches_time, frame_folder, video_path, max_skip_seconds=2.0, workers=4):
+    """
+    Extracts frames at the given timestamps in a single decoder session.
+
+    Timestamps are visited in sorted order so the decoder only moves forward:
+    nearby frames are reached by grabbing frames, and only large gaps seek.
+    Frames are written to disk in parallel.
+
+    Args:
+        matches_time (list): Timestamps as HH:MM:SS strings.
+        frame_folder (str): Folder to save the frames in.
+        video_path (str): Path to the video file.
+        max_skip_seconds (float): Largest gap decoded frame by frame instead of seeking.
+        workers (int): Number of threads writing frames.
+
+    Returns:
+        list: Paths of the extracted frames, in the order of matches_time.
+    """
+    os.makedirs(frame_folder, exist_ok=True)
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    targets = sorted(
+        (round(timestamp_to_seconds(timestamp) * fps), idx) for idx, timestamp in enumerate(matches_time)
+    )
+
+    extracted = {}
+    position = 0  # Index of the next frame the decoder returns
+    frame = None
+    with profiler.stage("extract_frames", items=len(targets)), ThreadPoolExecutor(max_workers=workers) as executor:
+        for target, idx in targets:
+            if frame is None or target != position - 1:
+                if target - position > max_skip_seconds * fps:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+                    position = target
+                success = True
+                while success and position < target:
+                    success = cap.grab()
+                    position += 1
+                success, frame = cap.read() if success else (False, None)
+                position += 1
+            if not success or frame is None:
+                print(f"Error extracting frame at {matches_time[idx]}")
+                frame = None
+                continue
+            output_image_path = os.path.join(frame_folder, f"frame_{idx:03d}.jpg")
+            extracted[idx] = executor.submit(cv2.imwrite, output_image_path, frame)
+            print(f"Extracted frame at {matches_time[idx]} -> {output_image_path}")
+    cap.release()
+
+    return [
+        os.path.join(frame_folder, f"frame_{idx:03d}.jpg")
+        for idx in sorted(extracted)
+        if extracted[idx].result()
+    ]
+
+
+def frames_for_timestamps(matches_time, frame_folder, video_path, scene_images_folder=None):
+    """
+    Returns the images of the matched timestamps, reusing scene keyframes where possible.
+
+    Timestamps inside a scene of the timeline saved by detect_and_save_scenes
+    map to that scene's keyframe, so only timestamps outside known scenes are
+    decoded from the video. Several timestamps in the same scene share its
+    keyframe. Keyframes are not reused if the timeline was detected in another video.
+
+    Args:
+        matches_time (list): Timestamps as HH:MM:SS strings.
+        frame_folder (str): Folder to save extracted frames in.
+        video_path (str): Path to the video file.
+        scene_images_folder (str): Optional folder with the scene images and timeline.
+
+    Returns:
+        list: Paths of the distinct images, in the order of the first timestamp showing each.
+    """
+    from detect_scenes import load_scene_timeline, scene_at, timeline_path_for
+
+    timeline = load_scene_timeline(timeline_path_for(scene_images_folder), video_path) if scene_images_folder else {}
+    images = {}
+    to_extract = []
+    for idx, timestamp in enumerate(matches_time):
+        scene = scene_at(timeline, timestamp_to_seconds(timestamp)) if timeline else None
+        keyframe = os.path.join(scene_images_folder, f"scene_{scene}.jpg") if scene else None
+        if keyframe and os.path.exists(keyframe):
+            print(f"Timestamp {timestamp} is in scene {scene} -> {keyframe}")
+            images[idx] = keyframe
+        else:
+            to_extract.append(idx)
+
+    if to_extract:
+        extracted = extract_frames_batch([matches_time[idx] for idx in to_extract], frame_folder, video_path)
+        # extract_frames_batch names frames by their position in the list it was given
+        for path in extracted:
+            position = int(os.path.splitext(os.path.basename(path))[0].split("_")[1])
+            images[to_extract[position]] = path
+    profiler.count("gemini_keyframes_reused", len(matches_time) - len(to_extract))
+
+    paths = []
+    for idx in sorted(images):
+        if images[idx] not in paths:
+            paths.append(images[idx])
+    return paths
@@ -1,66 +1,346 @@
 import json
 import os
-import moondream as md
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
+from caption_index import load_or_build_index
+from caption_store import CaptionStore, store_path_for
+from content_cache import file_hash
+from profiling import profiler
 
 
-def generate_captions(scene_images_folder, model_path, output_file="scene_captions.json"):
+def _load_existing_captions(output_file, store):
+    """Load existing captions from the JSON file and any captions committed to the store since."""
+    captions = {}
+    if os.path.exists(output_file):
+        print(f"{output_file} already exists. Loading existing captions...")
+        with open(output_file, "r") as f:
+            captions = json.load(f)
+    committed = store.load()
+    if committed:
+        print(f"Resuming with {len(committed)} captions from {store.path}.")
+        captions.update(committed)
+    return captions
+
+
+def _list_scene_images(scene_images_folder):
+    """Return all scene images as {scene_number: image_path}."""
+    return {
+        int(os.path.splitext(file)[0].split('_')[1]): os.path.join(scene_images_folder, file)
+        for file in os.listdir(scene_images_folder)
+        if file.endswith(".jpg") and file.startswith("scene_")
+    }
+
+
+def save_captions(captions, output_file, index_file, embedder=None):
+    """Save captions to JSON and index (and embed) the newly captioned scenes."""
+    with profiler.stage("save_captions", items=len(captions)):
+        tmp_file = f"{output_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(captions, f)
+        os.replace(tmp_file, output_file)
+
+    print(f"Captions saved to {output_file}.")
+
+    if index_file:
+        with profiler.stage("index_captions"):
+            index = load_or_build_index(index_file, captions)
+        print(f"Caption index updated ({len(index)} scenes) in {index_file}.")
+
+    if embedder:
+        with profiler.stage("embed_captions"):
+            embeddings = embedder.update(captions)
+        print(f"Embeddings updated ({len(embeddings)} scenes) in {embedder.embeddings_file}.")
+
+
+def generate_captions(scene_images_folder, model_path, output_file="scene_captions.json", index_file=None,
+                      cache=None, embedder=None):
     """
     Generates captions for a list of scene images and saves them to a JSON file.
 
+    Each caption is also committed to an append-only log next to output_file
+    as soon as it is produced, so an interrupted run resumes where it stopped.
+
     Args:
         scene_images_folder (str): Path to the folder containing scene images.
         model_path (str): Path to the moondream model file.
         output_file (str): Path to save the captions JSON file.
+        index_file (str): Optional path of a caption index to update with new scenes.
+        cache (ContentCache): Optional cache of captions keyed by the content hash of each image.
+        embedder (CaptionEmbedder): Optional embedder updated with the vectors of new scenes.
 
     Returns:
         dict: Scene captions as {scene_number: caption}.
     """
-    # Load existing captions if the JSON file exists
-    if os.path.exists(output_file):
-        print(f"{output_file} already exists. Loading existing captions...")
-        with open(output_file, "r") as f:
-            captions = json.load(f)
-    else:
-        captions = {}
-
-    # Get all scene images
-    scene_images = {
-        int(os.path.splitext(file)[0].split('_')[1]): os.path.join(scene_images_folder, file)
-        for file in os.listdir(scene_images_folder)
-        if file.endswith(".jpg") and file.startswith("scene_")
-    }
+    store = CaptionStore(store_path_for(output_file))
+    captions = _load_existing_captions(output_file, store)
+    scene_images = _list_scene_images(scene_images_folder)
 
     # Check if all scenes are already captioned
     if set(captions.keys()) == set(map(str, scene_images.keys())):
         print("All scenes already captioned. Skipping caption generation.")
+        if not os.path.exists(output_file):
+            # Every caption was committed to the log before the JSON was written
+            save_captions(captions, output_file, index_file, embedder)
         return captions
 
-    # Initialize the model
-    print("Initializing moondream model...")
-    model = md.vl(model=model_path)
-
     # Generate captions for missing scenes
+    model = None
     try:
-        for scene, image_path in scene_images.items():
+        for scene, image_path in sorted(scene_images.items()):
             if str(scene) in captions:
                 print(f"Scene {scene} already captioned. Skipping...")
                 continue
 
-            print(f"Processing scene {scene}...")
-            image = Image.open(image_path)
-            encoded_image = model.encode_image(image)
-            caption = model.caption(encoded_image)["caption"]
-            captions[str(scene)] = caption
+            key = file_hash(image_path) if cache else None
+            caption = cache.get("caption", key) if cache else None
+            if caption is not None:
+                print(f"Scene {scene} found in caption cache.")
+                profiler.count("caption_cache_hits")
+            else:
+                if model is None:
+                    # Initialize the model only once a scene actually needs it
+                    model = load_model(model_path)
 
-        # Save captions to JSON
-        with open(output_file, "w") as f:
-            json.dump(captions, f)
+                print(f"Processing scene {scene}...")
+                with profiler.stage("caption", items=1):
+                    image = Image.open(image_path)
+                    encoded_image = model.encode_image(image)
+                    caption = model.caption(encoded_image)["caption"]
+                if cache:
+                    cache.set("caption", key, caption)
+            captions[str(scene)] = caption
+            store.append(scene, caption)
 
-        print(f"Captions saved to {output_file}.")
+        save_captions(captions, output_file, index_file, embedder)
+        if cache:
+            print(f"Caption cache: {cache.stats()}")
         return captions
 
     except Exception as e:
         raise RuntimeError(f"Failed to generate captions: {e}")
+    finally:
+        store.close()
+
+
+def load_scene_image(image_path, max_size=768):
+    """
+    Open a scene image as RGB, shrunk to fit within max_size.
+
+    JPEG images are decoded directly at a reduced scale via Image.draft.
+
+    Args:
+        image_path (str): Path to the image.
+        max_size (int or tuple): Longest side, or (width, height) box, of the returned image.
+    """
+    box = (max_size, max_size) if isinstance(max_size, int) else tuple(max_size)
+    with profiler.stage("decode_image", items=1):
+        with Image.open(image_path) as image:
+            image.draft("RGB", box)
+            image = image.convert("RGB")
+        image.thumbnail(box)
+    return image
+
+
+def _prefetch_batches(scene_images, batch_size, max_size, prefetch, stop):
+    """
+    Yield batches of (scene, image) while a background thread decodes the next images.
+
+    Setting stop and closing the generator ends the thread even when the
+    consumer gave up with the queue full.
+
+    Args:
+        scene_images (list): List of (scene, image_path) to load.
+        batch_size (int): Number of images per batch.
+        max_size (int): Longest side of the decoded images.
+        prefetch (int): Maximum number of decoded images waiting for the model.
+        stop (threading.Event): Set by the consumer to stop decoding.
+    """
+    images = queue.Queue(maxsize=prefetch)
+    done = object()
+
+    def put(item):
+        """Put an item on the queue, giving up when the consumer has stopped."""
+        while not stop.is_set():
+            try:
+                images.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def decode():
+        for scene, image_path in scene_images:
+            if stop.is_set():
+                return
+            try:
+                image = load_scene_image(image_path, max_size)
+            except Exception as e:
+                print(f"Error loading image {image_path}: {e}")
+                continue
+            if not put((scene, image)):
+                return
+        put(done)
+
+    thread = threading.Thread(target=decode, daemon=True)
+    thread.start()
+    try:
+        batch = []
+        while (item := images.get()) is not done:
+            batch.append(item)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        stop.set()
+        # Free the decoded images nobody will caption
+        while True:
+            try:
+                images.get_nowait()
+            except queue.Empty:
+                break
+        thread.join()
+
+
+def load_model(model_path):
+    """Load the moondream model."""
+    import moondream as md
+
+    print("Initializing moondream model...")
+    with profiler.stage("model_load"):
+        return md.vl(model=model_path)
+
+
+def caption_batch(model, batch):
+    """
+    Caption a batch of (scene, image) with a moondream model.
+
+    Returns:
+        list: List of (scene, caption).
+    """
+    # moondream's vl client has no multi-image call, so encodings are computed back to back
+    with profiler.stage("caption", items=len(batch)):
+        encoded = [(scene, model.encode_image(image)) for scene, image in batch]
+        return [(scene, model.caption(encoded_image)["caption"]) for scene, encoded_image in encoded]
+
+
+def _commit(captions, store, results, cache=None, keys=None):
+    """Record captioned (scene, caption) pairs in memory, in the store and in the cache."""
+    for scene, caption in results:
+        captions[str(scene)] = caption
+        store.append(scene, caption)
+        if cache:
+            cache.set("caption", keys[scene], caption)
+
+
+_worker_model = None
+
+
+def _init_worker(model_path):
+    """Load one moondream model per worker process."""
+    import moondream as md
+
+    global _worker_model
+    _worker_model = md.vl(model=model_path)
 
 
+def _caption_batch_in_worker(batch):
+    return caption_batch(_worker_model, batch)
+
+
+def generate_captions_pipelined(scene_images_folder, model_path, output_file="scene_captions.json",
+                                index_file=None, batch_size=8, workers=1, max_image_size=768, prefetch=32,
+                                cache=None, embedder=None):
+    """
+    Generates captions with image decoding, batching and model inference overlapped.
+
+    A background thread decodes and resizes images ahead of the model. With
+    workers > 1, batches are captioned by a pool of processes that each load
+    their own model, which helps on CPU-only hosts.
+
+    Args:
+        scene_images_folder (str): Path to the folder containing scene images.
+        model_path (str): Path to the moondream model file.
+        output_file (str): Path to save the captions JSON file.
+        index_file (str): Optional path of a caption index to update with new scenes.
+        batch_size (int): Number of scenes sent to the model at once.
+        workers (int): Number of model processes (1 runs the model in this process).
+        max_image_size (int): Longest side of the images given to the model.
+        prefetch (int): Maximum number of decoded images waiting for the model.
+        cache (ContentCache): Optional cache of captions keyed by the content hash of each image.
+        embedder (CaptionEmbedder): Optional embedder updated with the vectors of new scenes.
+
+    Returns:
+        dict: Scene captions as {scene_number: caption}.
+    """
+    store = CaptionStore(store_path_for(output_file))
+    captions = _load_existing_captions(output_file, store)
+    pending = [
+        (scene, image_path)
+        for scene, image_path in sorted(_list_scene_images(scene_images_folder).items())
+        if str(scene) not in captions
+    ]
+    if not pending:
+        print("All scenes already captioned. Skipping caption generation.")
+        if not os.path.exists(output_file):
+            save_captions(captions, output_file, index_file, embedder)
+        return captions
+
+    stop = threading.Event()
+    batches = None
+    try:
+        keys = {}
+        if cache:
+            # Scenes seen before, e.g. in another copy of the video, skip the model entirely
+            misses = []
+            for scene, image_path in pending:
+                keys[scene] = file_hash(image_path)
+                caption = cache.get("caption", keys[scene])
+                if caption is None:
+                    misses.append((scene, image_path))
+                else:
+                    _commit(captions, store, [(scene, caption)])
+                    profiler.count("caption_cache_hits")
+            print(f"{len(pending) - len(misses)} scenes found in caption cache.")
+            pending = misses
+
+        print(f"Captioning {len(pending)} scenes with {workers} worker(s)...")
+        start = time.perf_counter()
+        batches = _prefetch_batches(pending, batch_size, max_image_size, prefetch, stop)
+        if pending and workers > 1:
+            # Workers profile themselves; this process only sees the whole captioning stage
+            with profiler.stage("caption", items=len(pending)), \
+                    ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                        initargs=(model_path,)) as executor:
+                # Keep a couple of batches in flight per worker so decoding stays bounded
+                in_flight = []
+                for batch in batches:
+                    in_flight.append(executor.submit(_caption_batch_in_worker, batch))
+                    if len(in_flight) >= 2 * workers:
+                        _commit(captions, store, in_flight.pop(0).result(), cache, keys)
+                for future in in_flight:
+                    _commit(captions, store, future.result(), cache, keys)
+        elif pending:
+            model = load_model(model_path)
+            for batch in batches:
+                _commit(captions, store, caption_batch(model, batch), cache, keys)
+        elapsed = time.perf_counter() - start
+        print(f"Captioned {len(pending)} scenes in {elapsed:.1f}s ({len(pending) / max(elapsed, 1e-9):.2f} scenes/sec).")
+
+        save_captions(captions, output_file, index_file, embedder)
+        if cache:
+            print(f"Caption cache: {cache.stats()}")
+        return captions
+
+    except Exception as e:
+        raise RuntimeError(f"Failed to generate captions: {e}")
+    finally:
+        # Stop the decoding thread if captioning failed before consuming every image
+        stop.set()
+        if batches is not None:
+            batches.close()
+        store.close()
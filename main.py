@@ -1,11 +1,146 @@
 import os
-from download_video import download_video
-from detect_scenes import detect_and_save_scenes
-from generate_captions import generate_captions
-from gemini_api import extract_frames, search_in_gemini , upload_to_gemini, wait_for_files_active 
-from search_captions import load_captions, search_captions_advanced, CaptionCompleter
-from create_collage import create_collage
-from prompt_toolkit import prompt
+
+# Heavy dependencies (OpenCV, scenedetect, moondream, Gemini, yt-dlp) are imported
+# inside the workflow that needs them, so choosing a mode is instant and mode 1
+# works without a GEMINI_API_KEY.
+
+# Set VIDEO_SEARCH_PROFILE to a JSON path to get a per-stage timing report of the run,
+# and VIDEO_SEARCH_PROFILE_STAGE to a stage name (e.g. "caption") to run it under cProfile.
+PROFILE_REPORT = os.environ.get("VIDEO_SEARCH_PROFILE")
+PROFILE_STAGE = os.environ.get("VIDEO_SEARCH_PROFILE_STAGE")
+
+
+def run_image_model(video_file, cache, thumbnail_cache):
+    """Image model workflow: detect scenes, caption them and search the captions."""
+    from detect_scenes import detect_and_save_scenes, format_timestamp, load_scene_timeline, timeline_path_for
+    from generate_captions import generate_captions
+    from search_captions import load_captions, CaptionCompleter
+    from caption_index import load_or_build_index
+    from create_collage import create_collage
+    from prompt_toolkit import prompt
+
+    print("\n--- Using Image Model ---")
+    print("Rank scenes by:")
+    print("1. Keywords (fuzzy BM25)")
+    print("2. Meaning (embeddings)")
+    semantic = input("Enter 1 or 2: ").strip() == "2"
+
+    # Scenes, captions and index live in a folder named after the cached video's source id,
+    # so another video never reuses them
+    video_dir = os.path.splitext(video_file)[0]
+    scene_images_folder = os.path.join(video_dir, "scene_images")
+    model_path = "path_to_moondream_model"  # Update with the correct model path
+    captions_file = os.path.join(video_dir, "scene_captions.json")
+    index_file = os.path.join(video_dir, "scene_captions.index.json")
+    embedder = None
+    if semantic:
+        from embedding_search import CaptionEmbedder, SentenceEncoder
+
+        # Vectors are computed alongside the captions and reused by every query
+        embedder = CaptionEmbedder(os.path.join(video_dir, "scene_captions.embeddings.npz"), SentenceEncoder())
+    os.makedirs(scene_images_folder, exist_ok=True)
+    if not os.listdir(scene_images_folder) and not os.path.exists(captions_file):
+        # Caption and index scenes while detection is still running
+        from pipeline import StreamingPipeline
+
+        StreamingPipeline(video_file, scene_images_folder, model_path, captions_file, index_file, cache=cache,
+                          thumbnail_cache=thumbnail_cache).run()
+        print(f"Scenes saved in {scene_images_folder} and captions saved to {captions_file}")
+
+    # Detect scenes in the video
+    if not os.listdir(scene_images_folder):
+        detect_and_save_scenes(video_file, scene_images_folder, single_pass=True, thumbnail_cache=thumbnail_cache)
+        print(f"Scenes saved in {scene_images_folder}")
+    else:
+        print(f"Scenes already detected and saved in {scene_images_folder}")
+
+    # Generate captions for the detected scenes
+    if not os.path.exists(captions_file):
+        generate_captions(scene_images_folder, model_path, captions_file, index_file, cache=cache,
+                          embedder=embedder)
+        print(f"Captions generated and saved to {captions_file}")
+    else:
+        print(f"Captions already exist in {captions_file}")
+
+    # Search captions dynamically with auto-complete
+    captions = load_captions(captions_file)
+    if semantic:
+        index = embedder.update(captions)
+    else:
+        index = load_or_build_index(index_file, captions)
+    completer = CaptionCompleter(captions)  # Use the completer for suggestions
+    search_word = prompt("Search the video using a word: ", completer=completer).strip()
+
+    if not search_word:
+        print("No search word provided. Exiting.")
+        return
+
+    if semantic:
+        threshold = 0.3  # Minimum cosine similarity
+        results = index.search_text(embedder.encoder, [search_word], limit=20, min_score=threshold)[0]
+    else:
+        threshold = 60  # Adjust similarity threshold
+        results = index.search(search_word, threshold)
+    matches = [scene for scene, _ in results]
+
+
+    if not matches:
+        print(f"No scenes found matching '{search_word}' with the given threshold ({threshold}).")
+        return
+    else:
+        print(f"Found scenes: {matches}")
+
+    # Report when each matched scene plays, from the timeline saved with the scene images
+    timeline = load_scene_timeline(timeline_path_for(scene_images_folder), video_file)
+    for scene in matches:
+        times = timeline.get(str(scene))
+        if times:
+            print(f"  Scene {scene}: {format_timestamp(times['start'])} - {format_timestamp(times['end'])}")
+
+    # Create a collage of the matched scenes
+    image_paths = [os.path.join(scene_images_folder, f"scene_{scene}.jpg") for scene in matches]
+    collage_file = "collage.png"
+    create_collage(image_paths, collage_file, thumbnail_cache=thumbnail_cache)
+    print(f"Collage created and saved to {collage_file}")
+
+
+def run_video_model(video_file, cache):
+    """Video model workflow: ask Gemini for matching timestamps and collect their frames."""
+    from gemini_api import frames_for_timestamps, search_in_gemini, search_in_gemini_sharded, video_duration
+    from create_collage import create_collage
+
+    print("\n--- Using Video Model (Gemini) ---")
+    user_query = input("Using a video model. What would you like me to find in the video? ").strip()
+
+    # Search using Gemini API
+    frame_folder = "gemini_frames"
+    video_path = video_file
+    if video_duration(video_path) > 15 * 60:
+        # Long videos are split into 10 minute segments that are analysed concurrently
+        matches_time = search_in_gemini_sharded(video_path, user_query, segment_seconds=600, cache=cache)
+    else:
+        matches_time = search_in_gemini(video_path, user_query, cache=cache)
+
+    if not matches_time:
+        print(f"No timestamps found matching query '{user_query}'.")
+        return
+
+    # Reuse keyframes of scenes detected by mode 1 for this video and extract only the remaining frames
+    scene_images_folder = os.path.join(os.path.splitext(video_path)[0], "scene_images")
+    extracted_frames = frames_for_timestamps(
+        matches_time, frame_folder, video_path,
+        scene_images_folder if os.path.isdir(scene_images_folder) else None,
+    )
+
+    if not extracted_frames:
+        print(f"No frames extracted for query '{user_query}'.")
+        return
+
+    # Create a collage of relevant frames
+    collage_file = "collage.png"
+    create_collage(extracted_frames, collage_file)
+    print(f"Collage created and saved to {collage_file}")
+
 
 def main():
     # Prompt user for mode
@@ -18,87 +153,35 @@ def main():
         print("Invalid choice. Exiting...")
         return
     
-    # Download the video
-    video_file = "downloaded_video.mp4"
-    if not os.path.exists(video_file):
-        video_url = "https://www.youtube.com/results?search_query=super+mario+movie+trailer"  # Super Mario movie trailer
-        download_video(video_url, video_file)
-        print(f"Video downloaded to {video_file}")
-    else:
-        print(f"Video already exists: {video_file}")
-
-    if choice == "1":
-        # Image Model Workflow
-        print("\n--- Using Image Model ---")
-        
-        # Detect scenes in the video
-        scene_images_folder = "scene_images"
-        os.makedirs(scene_images_folder, exist_ok=True)
-        if not os.listdir(scene_images_folder):
-            detect_and_save_scenes(video_file, scene_images_folder)
-            print(f"Scenes saved in {scene_images_folder}")
-        else:
-            print(f"Scenes already detected and saved in {scene_images_folder}")
-
-        # Generate captions for the detected scenes
-        model_path = "path_to_moondream_model"  # Update with the correct model path
-        captions_file = "scene_captions.json"
-        if not os.path.exists(captions_file):
-            generate_captions(scene_images_folder, model_path, captions_file)
-            print(f"Captions generated and saved to {captions_file}")
-        else:
-            print(f"Captions already exist in {captions_file}")
-
-        # Search captions dynamically with auto-complete
-        captions = load_captions(captions_file)
-        completer = CaptionCompleter(captions)  # Use the completer for suggestions
-        search_word = prompt("Search the video using a word: ", completer=completer).strip()
-        
-        if not search_word:
-            print("No search word provided. Exiting.")
-            return
-        
-        threshold = 60  # Adjust similarity threshold
-        matches = search_captions_advanced(captions, search_word, threshold)
-
-
-        if not matches:
-            print(f"No scenes found matching '{search_word}' with the given threshold ({threshold}).")
-            return
-        else:
-            print(f"Found scenes: {matches}")
-
-        # Create a collage of the matched scenes
-        image_paths = [os.path.join(scene_images_folder, f"scene_{scene}.jpg") for scene in matches]
-        collage_file = "collage.png"
-        create_collage(image_paths, collage_file)
-        print(f"Collage created and saved to {collage_file}")
-        
-    elif choice == "2":
-        # Video Model Workflow (Gemini API)
-        print("\n--- Using Video Model (Gemini) ---")
-        user_query = input("Using a video model. What would you like me to find in the video? ").strip()
-
-        # Search using Gemini API
-        frame_folder = "gemini_frames"
-        video_path = video_file
-        matches_time = search_in_gemini(video_path, user_query)
-
-        if not matches_time:
-            print(f"No timestamps found matching query '{user_query}'.")
-            return
-
-        # Extract frames from the video
-        extracted_frames = extract_frames(matches_time, frame_folder, video_path)
-
-        if not extracted_frames:
-            print(f"No frames extracted for query '{user_query}'.")
-            return
-
-        # Create a collage of relevant frames
-        collage_file = "collage.png"
-        create_collage(extracted_frames, collage_file)
-        print(f"Collage created and saved to {collage_file}")
+    from content_cache import ContentCache
+    from media_cache import MediaCache
+    from profiling import profiler
+    from thumbnail_cache import ThumbnailCache
+
+    if PROFILE_REPORT:
+        profiler.reset(trace_memory=True, cprofile_stage=PROFILE_STAGE,
+                       cprofile_file=f"{PROFILE_STAGE}.prof" if PROFILE_STAGE else None)
+
+    # Cache of captions and Gemini answers shared by re-downloaded copies of the video
+    cache = ContentCache(".cache")
+    # Collage tiles of scene images, reused by every query
+    thumbnail_cache = ThumbnailCache(".thumbnails")
+
+    # Download the video, or reuse it from the media cache
+    video_query = "super mario movie trailer"  # Super Mario movie trailer
+    # 480p is plenty for scene detection and captioning, and decodes much faster
+    media = MediaCache("media", max_height=480)
+    video_file = media.fetch(video_query)
+
+    try:
+        if choice == "1":
+            run_image_model(video_file, cache, thumbnail_cache)
+        elif choice == "2":
+            run_video_model(video_file, cache)
+    finally:
+        if PROFILE_REPORT:
+            profiler.save_report(PROFILE_REPORT)
+            print(f"Profiling report saved to {PROFILE_REPORT}")
 
 
 
@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from profiling import profiler
+
+
+def format_for_height(max_height):
+    """
+    Return a yt-dlp format selector capped at max_height.
+
+    Single-file formats are preferred so no ffmpeg merge is needed; the
+    smallest available format is the last resort when none fits the cap.
+    """
+    if not max_height:
+        return "best"
+    return f"best[height<={max_height}][ext=mp4]/best[height<={max_height}]/worst"
+
+
+def _total_size(headers, offset=0):
+    """Return the full size of a file from the headers of a response starting at offset, or None."""
+    # Content-Range: bytes <start>-<end>/<total>, or bytes */<total> on a 416
+    total = (headers.get("Content-Range") or "").rpartition("/")[2]
+    if total.isdigit():
+        return int(total)
+    length = headers.get("Content-Length")
+    return offset + int(length) if length and length.isdigit() else None
+
+
+class HttpDownloader:
+    """
+    Downloader for direct http(s) links to video files.
+
+    Data is written to <output_path>.part and resumed with a Range request
+    when a previous download was interrupted; the file is renamed to
+    output_path once its size matches the one announced by the server.
+    """
+
+    def __init__(self, chunk_size=1 << 20, timeout=30):
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+    def resolve(self, source):
+        """Return the metadata of a source; the URL itself identifies the video."""
+        name = os.path.basename(source.split("?")[0]) or "video"
+        digest = hashlib.sha1(source.encode()).hexdigest()[:12]
+        return {"id": f"http-{digest}", "title": os.path.splitext(name)[0], "url": source}
+
+    def download(self, info, output_path, max_height=None):
+        """Download info["url"] to output_path, resuming a partial download."""
+        part_path = f"{output_path}.part"
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        request = urllib.request.Request(info["url"], headers={"Range": f"bytes={offset}-"} if offset else {})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                # A server without range support sends the whole file again
+                resumed = offset and response.status == 206
+                expected = _total_size(response.headers, offset if resumed else 0)
+                with open(part_path, "ab" if resumed else "wb") as f:
+                    shutil.copyfileobj(response, f, self.chunk_size)
+        except urllib.error.HTTPError as e:
+            # Nothing left to send after the offset: the .part file is already complete
+            if not (offset and e.code == 416):
+                raise
+            total = (e.headers.get("Content-Range") or "").rpartition("/")[2]
+            expected = int(total) if total.isdigit() else offset
+        size = os.path.getsize(part_path)
+        if expected is not None and size != expected:
+            raise OSError(f"Incomplete download of {info['url']}: {size} of {expected} bytes")
+        os.replace(part_path, output_path)
+        return {}
+
+
+class MediaCache:
+    """
+    Local cache of downloaded videos keyed by source id.
+
+    Each video is stored as <source id>.mp4 with a <source id>.json holding
+    its metadata, and every query or URL that resolved to it is remembered,
+    so later runs find it without contacting the site. Downloads are capped
+    at max_height, which is all scene detection and captioning need, and
+    interrupted downloads resume from their .part file.
+    """
+
+    def __init__(self, cache_dir="media", max_height=480, downloader=None):
+        """
+        Args:
+            cache_dir (str): Folder holding the videos and their metadata.
+            max_height (int): Highest resolution downloaded (None for the best available).
+            downloader: Object with resolve(source) -> info dict with an "id", and
+                download(info, output_path, max_height) -> extra metadata. Defaults to
+                yt-dlp for search queries and page URLs.
+        """
+        self.cache_dir = cache_dir
+        self.max_height = max_height
+        self.downloader = downloader
+        self._lock = threading.Lock()
+        self._source_locks = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _downloader(self):
+        if self.downloader is None:
+            from download_video import YtDlpDownloader
+
+            self.downloader = YtDlpDownloader()
+        return self.downloader
+
+    def _aliases_file(self):
+        return os.path.join(self.cache_dir, "sources.json")
+
+    def _load_aliases(self):
+        if not os.path.exists(self._aliases_file()):
+            return {}
+        with open(self._aliases_file(), "r") as f:
+            return json.load(f)
+
+    def _write_json(self, path, data):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def video_path(self, source_id):
+        return os.path.join(self.cache_dir, f"{re.sub(r'[^A-Za-z0-9_.-]', '_', source_id)}.mp4")
+
+    def metadata(self, source_id):
+        """Return the metadata of a cached video, or None."""
+        meta_file = f"{os.path.splitext(self.video_path(source_id))[0]}.json"
+        if not os.path.exists(meta_file):
+            return None
+        with open(meta_file, "r") as f:
+            return json.load(f)
+
+    def get(self, source):
+        """
+        Return the path of a cached video for a query, URL or source id, without downloading.
+
+        A video downloaded with a different max_height is not a hit.
+
+        Returns:
+            str: Path of the video file, or None if it is not cached.
+        """
+        with self._lock:
+            source_id = self._load_aliases().get(source, source)
+        path = self.video_path(source_id)
+        if self._is_cached(self.metadata(source_id), path):
+            return path
+        return None
+
+    def _is_cached(self, meta, path):
+        return bool(meta) and meta.get("max_height") == self.max_height and os.path.exists(path)
+
+    def fetch(self, source):
+        """
+        Return the path of a video, downloading it unless it is cached.
+
+        Args:
+            source (str): Search query, URL or source id.
+
+        Returns:
+            str: Path of the video file.
+        """
+        cached = self.get(source)
+        if cached:
+            print(f"Video for '{source}' found in media cache: {cached}")
+            profiler.count("media_cache_hits")
+            return cached
+
+        downloader = self._downloader()
+        try:
+            info = downloader.resolve(source)
+        except Exception as e:
+            raise RuntimeError(f"Failed to resolve video '{source}': {e}")
+        source_id = info["id"]
+        with self._lock:
+            # One download per video, even when several sources resolve to it
+            source_lock = self._source_locks.setdefault(source_id, threading.Lock())
+
+        with source_lock:
+            path = self.video_path(source_id)
+            meta = self.metadata(source_id)
+            if not self._is_cached(meta, path):
+                if os.path.exists(f"{path}.part"):
+                    print(f"Resuming download of '{source}'...")
+                else:
+                    print(f"Downloading '{source}'...")
+                try:
+                    with profiler.stage("download") as record:
+                        extra = downloader.download(info, path, self.max_height) or {}
+                        record["items"] = os.path.getsize(path)
+                except Exception as e:
+                    raise RuntimeError(f"Failed to download video '{source}': {e}")
+                meta = {key: value for key, value in info.items() if isinstance(value, (str, int, float))}
+                meta.update(extra)
+                meta.update(
+                    source_id=source_id,
+                    path=path,
+                    size=os.path.getsize(path),
+                    max_height=self.max_height,
+                    downloaded_at=time.time(),
+                )
+                self._write_json(f"{os.path.splitext(path)[0]}.json", meta)
+                print(f"Video saved to {path}")
+
+            with self._lock:
+                aliases = self._load_aliases()
+                aliases[source] = source_id
+                self._write_json(self._aliases_file(), aliases)
+        return path
+
+    def fetch_many(self, sources, workers=4):
+        """
+        Download several videos concurrently.
+
+        Args:
+            sources (list): Search queries, URLs or source ids.
+            workers (int): Maximum number of simultaneous downloads.
+
+        Returns:
+            dict: Video path for each source as {source: path}.
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            paths = list(executor.map(self.fetch, sources))
+        return dict(zip(sources, paths))
@@ -0,0 +1,234 @@
+import os
+import queue
+import threading
+import time
+from caption_index import CaptionIndex
+from caption_store import CaptionStore, store_path_for
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    """Raised inside a stage when another stage has failed."""
+
+
+class StreamingPipeline:
+    """
+    Runs scene detection, captioning and indexing concurrently.
+
+    Detection saves each scene image as soon as its cut is found and hands it
+    to the captioning stage through a bounded queue once the next cut confirms
+    it; captions are committed to the caption log and added to an in-memory
+    BM25 index as they arrive. If any stage fails, all stages stop and the
+    error is raised from join(). The first scenes become searchable seconds
+    after the start, and total time approaches that of the slowest stage
+    instead of the sum of all stages.
+    """
+
+    def __init__(self, video_path, scene_images_folder, model_path, captions_file="scene_captions.json",
+                 index_file=None, queue_size=16, batch_size=4, max_image_size=768, cache=None,
+                 thumbnail_cache=None):
+        """
+        Args:
+            video_path (str): Path to the video file.
+            scene_images_folder (str): Path to save scene images.
+            model_path (str): Path to the moondream model file.
+            captions_file (str): Path to save the captions JSON file.
+            index_file (str): Optional path to save the caption index.
+            queue_size (int): Maximum number of items waiting between two stages.
+            batch_size (int): Maximum number of scenes captioned together.
+            max_image_size (int): Longest side of the images given to the model.
+            cache (ContentCache): Optional cache of captions keyed by the content hash of each image.
+            thumbnail_cache (ThumbnailCache): Optional cache filled with collage tiles during detection.
+        """
+        self.video_path = video_path
+        self.scene_images_folder = scene_images_folder
+        self.model_path = model_path
+        self.captions_file = captions_file
+        self.index_file = index_file
+        self.batch_size = batch_size
+        self.max_image_size = max_image_size
+        self.cache = cache
+        self.thumbnail_cache = thumbnail_cache
+        self.captions = {}
+        self.index = CaptionIndex()
+        self.lock = threading.Lock()
+        self.first_searchable = None
+        self._scenes = queue.Queue(maxsize=queue_size)
+        self._results = queue.Queue(maxsize=queue_size)
+        self._errors = []
+        self._stop = threading.Event()
+        self._dropped = set()
+        self._threads = []
+        self._start_time = None
+
+    def _fail(self, error):
+        """Record the first error of a stage and tell every other stage to stop."""
+        if not self._stop.is_set():
+            self._errors.append(error)
+        self._stop.set()
+
+    def _put(self, q, item):
+        """Put an item on a queue, giving up when the pipeline is stopping."""
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, q):
+        """Get an item from a queue, giving up when the pipeline is stopping."""
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def _detect(self):
+        from detect_scenes import _scene_image_path, detect_and_save_scenes
+
+        # Single-pass detection may still drop or replace the newest image, so a
+        # scene is only handed on once a later scene has been found after it
+        pending = {}
+        sent = set()
+
+        def send(scene):
+            self._put(self._scenes, (scene, pending.pop(scene)))
+            sent.add(scene)
+
+        def on_scene(scene, image_path):
+            for earlier in sorted(s for s in pending if s < scene):
+                send(earlier)
+            pending[scene] = image_path
+
+        try:
+            scenes = detect_and_save_scenes(
+                self.video_path, self.scene_images_folder, single_pass=True,
+                on_scene=on_scene, thumbnail_cache=self.thumbnail_cache,
+            )
+            # Detection is over: every image still on disk is final
+            final = {scene for scene in range(1, len(scenes) + 1)
+                     if os.path.exists(_scene_image_path(self.scene_images_folder, scene))}
+            for scene in sorted(pending):
+                if scene in final:
+                    send(scene)
+            self._dropped = sent - final
+            self._put(self._scenes, _DONE)
+        except _Stopped:
+            pass
+        except Exception as e:
+            self._fail(e)
+
+    def _next_batch(self):
+        """Wait for at least one scene, then take whatever else is already queued."""
+        batch = [self._get(self._scenes)]
+        while batch[-1] is not _DONE and len(batch) < self.batch_size:
+            try:
+                batch.append(self._scenes.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _caption(self):
+        from content_cache import file_hash
+        from generate_captions import caption_batch, load_model, load_scene_image
+
+        try:
+            model = None
+            done = False
+            while not done:
+                batch = []
+                for item in self._next_batch():
+                    if item is _DONE:
+                        done = True
+                        continue
+                    scene, image_path = item
+                    key = file_hash(image_path) if self.cache else None
+                    cached = self.cache.get("caption", key) if self.cache else None
+                    if cached is not None:
+                        self._put(self._results, [(scene, cached)])
+                        continue
+                    try:
+                        batch.append((scene, load_scene_image(image_path, self.max_image_size), key))
+                    except OSError as e:
+                        # The image may have been replaced by a later, more exact keyframe
+                        print(f"Error loading image {image_path}: {e}")
+                if batch:
+                    if model is None:
+                        model = load_model(self.model_path)
+                    results = caption_batch(model, [(scene, image) for scene, image, _ in batch])
+                    if self.cache:
+                        for (_, caption), (_, _, key) in zip(results, batch):
+                            self.cache.set("caption", key, caption)
+                    self._put(self._results, results)
+            self._put(self._results, _DONE)
+        except _Stopped:
+            pass
+        except Exception as e:
+            self._fail(e)
+
+    def _index(self):
+        try:
+            with CaptionStore(store_path_for(self.captions_file)) as store:
+                while (results := self._get(self._results)) is not _DONE:
+                    for scene, caption in results:
+                        store.append(scene, caption)
+                        with self.lock:
+                            self.captions[str(scene)] = caption
+                            self.index.add(scene, caption)
+                    if self.first_searchable is None:
+                        self.first_searchable = time.perf_counter() - self._start_time
+                        print(f"First scenes searchable after {self.first_searchable:.1f}s.")
+        except _Stopped:
+            pass
+        except Exception as e:
+            self._fail(e)
+
+    def start(self):
+        """Start all stages in background threads."""
+        self._start_time = time.perf_counter()
+        os.makedirs(self.scene_images_folder, exist_ok=True)
+        for target in (self._detect, self._caption, self._index):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def search(self, query, threshold=60, limit=None):
+        """Search the scenes captioned so far; safe to call while the pipeline runs."""
+        with self.lock:
+            return self.index.search(query, threshold, limit)
+
+    def join(self):
+        """
+        Wait for all stages, then save the captions JSON and the index.
+
+        Returns:
+            dict: Scene captions as {scene_number: caption}.
+        """
+        for thread in self._threads:
+            thread.join()
+        if self._errors:
+            raise RuntimeError(f"Streaming pipeline failed: {self._errors[0]}")
+
+        from generate_captions import save_captions
+
+        with self.lock:
+            for scene in self._dropped:
+                self.captions.pop(str(scene), None)
+                self.index.remove(scene)
+        elapsed = time.perf_counter() - self._start_time
+        print(f"Pipeline captioned {len(self.captions)} scenes in {elapsed:.1f}s.")
+        save_captions(self.captions, self.captions_file, None)
+        if self.index_file:
+            self.index.save(self.index_file)
+        return self.captions
+
+    def run(self):
+        """Run the whole pipeline and wait for it to finish."""
+        return self.start().join()
@@ -0,0 +1,159 @@
+import cProfile
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class Profiler:
+    """
+    Per-stage timers and counters for one run of the pipeline.
+
+    Stages are timed with ``with profiler.stage("name", items=n):`` and may
+    be nested or run from several threads; calls, wall-clock seconds and
+    processed items add up per stage name. Peak memory is tracked with
+    tracemalloc when trace_memory is enabled (it slows allocations down);
+    a stage's peak covers only the time the stage was running, including
+    work of other threads meanwhile. The process-wide maximum resident set
+    size is always reported where the platform provides it. A single stage
+    can be run under cProfile; only the thread that enters the stage is
+    profiled.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, trace_memory=False, cprofile_stage=None, cprofile_file=None):
+        """
+        Clear all measurements and start a new run.
+
+        Args:
+            trace_memory (bool): Track Python heap peaks per stage with tracemalloc.
+            cprofile_stage (str): Optional stage name to run under cProfile.
+            cprofile_file (str): Optional path for the cProfile stats of that stage.
+        """
+        self.stages = {}
+        self.counters = {}
+        self.cprofile_stage = cprofile_stage
+        self.cprofile_file = cprofile_file
+        self._cprofile = None
+        self._lock = threading.Lock()
+        # Peak of each running stage and of the whole run, kept across tracemalloc.reset_peak()
+        self._stage_peaks = {}
+        self._run_peak = 0
+        self._start = time.perf_counter()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if trace_memory:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, items=0):
+        """
+        Time a block of work as part of a stage.
+
+        Args:
+            name (str): Stage name.
+            items (int): Number of items processed in the block, for throughput.
+
+        Yields:
+            dict: {"items": items}; set "items" inside the block when the count
+                is only known once the work is done.
+        """
+        cprofile = None
+        if name == self.cprofile_stage:
+            with self._lock:
+                # Only the first entry into the stage is profiled
+                if self._cprofile is None:
+                    cprofile = self._cprofile = cProfile.Profile()
+            if cprofile:
+                cprofile.enable()
+        record = {"items": items}
+        token = object()
+        if tracemalloc.is_tracing():
+            with self._lock:
+                # Restart the peak so this stage does not inherit the peak of earlier work
+                self._fold_peak()
+                tracemalloc.reset_peak()
+                self._stage_peaks[token] = 0
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            elapsed = time.perf_counter() - start
+            if cprofile:
+                cprofile.disable()
+                if self.cprofile_file:
+                    cprofile.dump_stats(self.cprofile_file)
+            with self._lock:
+                peak = None
+                if token in self._stage_peaks:
+                    self._fold_peak()
+                    peak = self._stage_peaks.pop(token)
+                stats = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "items": 0})
+                stats["calls"] += 1
+                stats["seconds"] += elapsed
+                stats["items"] += record["items"]
+                if peak is not None:
+                    stats["peak_traced_bytes"] = max(stats.get("peak_traced_bytes", 0), peak)
+
+    def _fold_peak(self):
+        """Add the tracemalloc peak so far to every running stage and the run; caller holds the lock."""
+        if not tracemalloc.is_tracing():
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for token in self._stage_peaks:
+            self._stage_peaks[token] = max(self._stage_peaks[token], peak)
+        self._run_peak = max(self._run_peak, peak)
+
+    def count(self, name, items=1):
+        """Add to a counter without timing anything."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + items
+
+    def report(self):
+        """
+        Return the measurements of the current run.
+
+        Returns:
+            dict: Wall-clock time, peak memory, and per-stage calls, seconds,
+                items and items per second.
+        """
+        with self._lock:
+            stages = {
+                name: dict(stats, items_per_second=stats["items"] / stats["seconds"] if stats["seconds"] else None)
+                for name, stats in self.stages.items()
+            }
+            counters = dict(self.counters)
+            self._fold_peak()
+            run_peak = self._run_peak if tracemalloc.is_tracing() else None
+        report = {
+            "wall_seconds": time.perf_counter() - self._start,
+            "peak_rss_bytes": None,
+            "peak_traced_bytes": run_peak,
+            "stages": stages,
+            "counters": counters,
+        }
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            report["peak_rss_bytes"] = maxrss if sys.platform == "darwin" else maxrss * 1024
+        if self._cprofile is not None:
+            report["cprofile"] = {"stage": self.cprofile_stage, "file": self.cprofile_file}
+        return report
+
+    def save_report(self, report_file):
+        """Write the report of the current run as JSON."""
+        with open(report_file, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+# Shared by every module of the pipeline
+profiler = Profiler()
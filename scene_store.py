@@ -0,0 +1,249 @@
+import json
+import os
+import shutil
+from collections.abc import Mapping, Sequence
+import numpy as np
+from search_captions import load_captions, tokenize
+
+_STRING_COLUMNS = ("caption", "image_path", "vocab")
+
+
+def store_dir_for(captions_file):
+    """Return the scene store folder kept alongside a captions JSON file."""
+    return f"{os.path.splitext(captions_file)[0]}.scenes"
+
+
+def _pack_strings(strings):
+    """Pack strings into (offsets, UTF-8 bytes) columns."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return offsets, data
+
+
+class StringColumn(Sequence):
+    """
+    Read-only sequence over a packed string column.
+
+    Indexing decodes a single row; iterating decodes all rows from one copy of the bytes.
+    """
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = range(len(self))[i]
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        offsets = self.offsets.tolist()
+        data = self.data.tobytes()
+        for start, end in zip(offsets, offsets[1:]):
+            yield data[start:end].decode("utf-8")
+
+
+class SceneCaptions(Mapping):
+    """
+    Read-only {scene_number: caption} view of a scene store.
+
+    A caption is decoded only when it is read, and values() is the caption
+    column itself, so nothing is copied into a dict.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, scene):
+        i = self.store.find(scene)
+        if i is None:
+            raise KeyError(scene)
+        return self.store.caption(i)
+
+    def __iter__(self):
+        return (str(scene) for scene in self.store.columns["scene"].tolist())
+
+    def __len__(self):
+        return len(self.store)
+
+    def values(self):
+        return self.store.column("caption")
+
+
+class SceneStore:
+    """
+    Columnar, memory-mapped store of the scenes of one video.
+
+    Each scene is one row of the scene id, start/end time, image path,
+    caption and pre-tokenized caption. Numeric columns are plain arrays;
+    strings are stored as an offsets array into one UTF-8 byte array, and
+    tokens as ids into a shared vocabulary. Every column is a .npy file
+    opened with ``mmap_mode="r"``, so opening a store reads no row data and
+    rows are decoded only when accessed.
+    """
+
+    def __init__(self, store_dir, columns, meta):
+        self.store_dir = store_dir
+        self.columns = columns
+        self.meta = meta
+        self._vocab = None
+
+    def __len__(self):
+        return len(self.columns["scene"])
+
+    @staticmethod
+    def write(store_dir, captions, timeline=None, image_folder=None, source=None):
+        """
+        Write a scene store, replacing any existing one.
+
+        Args:
+            store_dir (str): Folder of the store.
+            captions (dict): Scene captions as {scene_number: caption}.
+            timeline (dict): Optional scene timeline as saved by detect_and_save_scenes.
+            image_folder (str): Optional folder holding the scene images.
+            source (list): Optional version of the data the store was built from.
+        """
+        timeline = timeline or {}
+        scenes = sorted(captions, key=int)
+        vocab = {}
+        token_ids = []
+        token_counts = []
+        for scene in scenes:
+            tokens = tokenize(captions[scene])
+            token_ids.extend(vocab.setdefault(token, len(vocab)) for token in tokens)
+            token_counts.append(len(tokens))
+        token_offsets = np.zeros(len(scenes) + 1, dtype=np.int64)
+        np.cumsum(token_counts, out=token_offsets[1:])
+
+        columns = {
+            "scene": np.array([int(scene) for scene in scenes], dtype=np.int64),
+            "start": np.array([timeline.get(str(scene), {}).get("start", np.nan) for scene in scenes],
+                              dtype=np.float64),
+            "end": np.array([timeline.get(str(scene), {}).get("end", np.nan) for scene in scenes],
+                            dtype=np.float64),
+            "token_offsets": token_offsets,
+            "token_ids": np.array(token_ids, dtype=np.int32),
+        }
+        strings = {
+            "caption": [captions[scene] for scene in scenes],
+            "image_path": [os.path.join(image_folder, f"scene_{scene}.jpg") if image_folder else ""
+                           for scene in scenes],
+            "vocab": list(vocab),
+        }
+        for name in _STRING_COLUMNS:
+            columns[f"{name}_offsets"], columns[f"{name}_data"] = _pack_strings(strings[name])
+
+        # Write next to the store and swap it in, so readers never see a partial store
+        tmp_dir = f"{store_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name, column in columns.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), column)
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump({"version": 1, "count": len(scenes), "source": source}, f)
+        old_dir = f"{store_dir}.old"
+        if os.path.exists(store_dir):
+            os.replace(store_dir, old_dir)
+        os.replace(tmp_dir, store_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    @classmethod
+    def open(cls, store_dir):
+        """Memory-map a store written by :meth:`write`."""
+        with open(os.path.join(store_dir, "meta.json"), "r") as f:
+            meta = json.load(f)
+        columns = {
+            file[:-len(".npy")]: np.load(os.path.join(store_dir, file), mmap_mode="r")
+            for file in os.listdir(store_dir) if file.endswith(".npy")
+        }
+        return cls(store_dir, columns, meta)
+
+    def column(self, name):
+        """Return a string column, e.g. "caption", as a lazily decoded sequence."""
+        return StringColumn(self.columns[f"{name}_offsets"], self.columns[f"{name}_data"])
+
+    def _string(self, name, i):
+        return self.column(name)[i]
+
+    def find(self, scene):
+        """Return the row of a scene, or None if the store does not have it."""
+        scenes = self.columns["scene"]
+        try:
+            scene = int(scene)
+        except (TypeError, ValueError):
+            return None
+        i = int(np.searchsorted(scenes, scene))
+        return i if i < len(scenes) and scenes[i] == scene else None
+
+    def caption(self, i):
+        return self._string("caption", i)
+
+    def image_path(self, i):
+        return self._string("image_path", i)
+
+    def tokens(self, i):
+        """Return the caption tokens of a row."""
+        if self._vocab is None:
+            self._vocab = list(self.column("vocab"))
+        offsets = self.columns["token_offsets"]
+        return [self._vocab[t] for t in self.columns["token_ids"][offsets[i]:offsets[i + 1]]]
+
+    def times(self, i):
+        """Return (start, end) of a row in seconds, or None if the timing is unknown."""
+        start, end = float(self.columns["start"][i]), float(self.columns["end"][i])
+        return None if np.isnan(start) else (start, end)
+
+    def row(self, i):
+        """Return all fields of a row as a dict."""
+        times = self.times(i)
+        return {
+            "scene": int(self.columns["scene"][i]),
+            "start": times[0] if times else None,
+            "end": times[1] if times else None,
+            "image_path": self.image_path(i),
+            "caption": self.caption(i),
+            "tokens": self.tokens(i),
+        }
+
+    def captions(self):
+        """Return a lazily decoded {scene_number: caption} view, keyed like load_captions."""
+        return SceneCaptions(self)
+
+
+def load_or_build_scene_store(captions_file, image_folder=None):
+    """
+    Open the scene store of a captions file, rebuilding it when the captions changed.
+
+    Args:
+        captions_file (str): Path of the captions JSON file.
+        image_folder (str): Optional folder holding the scene images and timeline.
+
+    Returns:
+        SceneStore: The up-to-date store.
+    """
+    from detect_scenes import load_scene_timeline, timeline_path_for
+
+    store_dir = store_dir_for(captions_file)
+    stat = os.stat(captions_file)
+    source = [stat.st_mtime_ns, stat.st_size]
+    if image_folder:
+        timeline_file = timeline_path_for(image_folder)
+        if os.path.exists(timeline_file):
+            stat = os.stat(timeline_file)
+            source += [stat.st_mtime_ns, stat.st_size]
+    try:
+        store = SceneStore.open(store_dir)
+        if store.meta.get("source") == source:
+            return store
+    except (OSError, ValueError):
+        pass
+
+    timeline = load_scene_timeline(timeline_path_for(image_folder)) if image_folder else {}
+    SceneStore.write(store_dir, load_captions(captions_file), timeline, image_folder, source)
+    return SceneStore.open(store_dir)
@@ -1,51 +1,297 @@
+import heapq
 import json
+import os
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+import numpy as np
 from rapidfuzz import process, fuzz
 from prompt_toolkit import prompt
 from prompt_toolkit.completion import Completer, Completion
+from caption_store import CaptionStore
+from profiling import profiler
 
 class CaptionCompleter(Completer):
-    def __init__(self, captions):
-        """Initialize the completer with a list of captions."""
-        self.words = set()
+    def __init__(self, captions, max_completions=10, max_cached_prefixes=512):
+        """
+        Initialize the completer with a list of captions.
+
+        Args:
+            captions (dict): Dictionary of scene captions.
+            max_completions (int): Maximum number of suggestions yielded per keystroke.
+            max_cached_prefixes (int): Maximum number of prefix rankings remembered.
+        """
+        counts = Counter()
         for caption in captions.values():
-            self.words.update(caption.lower().split())
+            counts.update(tokenize(caption))
+        # Sorted vocabulary: words sharing a prefix form one contiguous range
+        self.words = sorted(counts)
+        self.counts = counts
+        self.max_completions = max_completions
+        self.max_cached_prefixes = max_cached_prefixes
+        self._ranked = OrderedDict()
+
+    def rank(self, prefix):
+        """
+        Return the most frequent words starting with prefix.
+
+        Args:
+            prefix (str): Lowercase word prefix.
+
+        Returns:
+            list: Up to max_completions words, most frequent first.
+        """
+        ranked = self._ranked.get(prefix)
+        if ranked is not None:
+            self._ranked.move_to_end(prefix)
+        else:
+            lo = bisect_left(self.words, prefix)
+            hi = bisect_left(self.words, prefix + "\U0010ffff", lo)
+            candidates = self.words[lo:hi]
+            if len(candidates) > self.max_completions:
+                candidates = heapq.nlargest(self.max_completions, candidates, key=self.counts.__getitem__)
+            else:
+                candidates = sorted(candidates, key=self.counts.__getitem__, reverse=True)
+            ranked = candidates
+            # Remember the ranking so repeated keystrokes are a dict lookup; prefixes
+            # matching no word are cheap to rank again and are not kept
+            if ranked:
+                self._ranked[prefix] = ranked
+                if len(self._ranked) > self.max_cached_prefixes:
+                    self._ranked.popitem(last=False)
+        return ranked
+
+    def clear_cache(self):
+        """Forget the remembered prefix rankings."""
+        self._ranked.clear()
 
     def get_completions(self, document, complete_event):
-        """Yield auto-complete suggestions based on the current input."""
-        word = document.text.lower()
-        for w in sorted(self.words):
-            if w.startswith(word):
-                yield Completion(w, start_position=-len(word))
+        """Yield auto-complete suggestions for the word before the cursor."""
+        text = document.text_before_cursor
+        word = text.split()[-1] if text and not text[-1].isspace() else ""
+        for w in self.rank(word.lower()):
+            yield Completion(w, start_position=-len(word))
+
+def tokenize(text):
+    """Split text into lowercase word tokens."""
+    return re.findall(r"\w+", text.lower())
+
 
 def load_captions(captions_file):
-    """Load captions from a JSON file."""
+    """
+    Load captions from a JSON file, from a caption log (.jsonl) that may still be growing,
+    or from a scene store folder.
+    """
+    if os.path.isdir(captions_file):
+        from scene_store import SceneStore
+
+        return dict(SceneStore.open(captions_file).captions())
+    if captions_file.endswith(".jsonl"):
+        return CaptionStore(captions_file).load()
     with open(captions_file, "r") as f:
         return json.load(f)
 
 
-def search_captions_advanced(captions, keyword, threshold):
+def caption_version(captions_file):
     """
-    Advanced search using rapidfuzz for keyword similarity in captions.
+    Return the version of a captions file, which changes whenever captions are written to it.
 
-    Args:
-        captions (dict): Dictionary of scene captions.
-        keyword (str): Word to search for.
-        threshold (float): Similarity threshold (0-100).
+    generate_captions replaces the JSON file atomically and appends to the
+    caption log, so either the inode, the size or the modification time changes.
+    """
+    if os.path.isdir(captions_file):
+        captions_file = os.path.join(captions_file, "meta.json")
+    stat = os.stat(captions_file)
+    return (os.path.abspath(captions_file), stat.st_ino, stat.st_size, stat.st_mtime_ns)
 
-    Returns:
-        list: List of scene numbers with captions matching the keyword.
+
+class QueryCache:
     """
-    matches = []
-    for scene, caption in captions.items():
-        match_score = process.extractOne(keyword, [caption], score_cutoff=threshold)
-        if match_score:
-            matches.append(scene)
-    return matches
+    Bounded LRU cache of ranked search results.
 
+    Entries are keyed by the query as the scorer sees it and the version of
+    the caption set, so results of captions that have since changed are
+    never returned and simply age out. Each entry keeps the ranking at the
+    loosest threshold searched so far; a search with a tighter threshold is
+    answered by filtering it instead of rescoring every caption. A cache
+    may be shared by searches running on several threads.
+    """
+
+    def __init__(self, max_entries=256):
+        """
+        Args:
+            max_entries (int): Maximum number of (query, caption set) entries kept.
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
 
+    def get(self, query, threshold, version):
+        """
+        Return the cached ranking of a query, or None if it has to be searched.
 
+        Returns:
+            list: List of (scene, score) tuples with score >= threshold, best match first.
+        """
+        with self._lock:
+            entry = self._entries.get((query, version))
+            if entry is None or entry[0] > threshold:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((query, version))
+            self.hits += 1
+        cached_threshold, ranked = entry
+        if cached_threshold == threshold:
+            return list(ranked)
+        return [(scene, score) for scene, score in ranked if score >= threshold]
 
+    def put(self, query, threshold, version, ranked):
+        """Store the full ranking of a query at a threshold, keeping the loosest one."""
+        key = (query, version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or threshold < entry[0]:
+                self._entries[key] = (threshold, list(ranked))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
 
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
 
 
+class CaptionSearchEngine:
+    """
+    Fuzzy caption search over a whole corpus in one batched call.
+
+    Captions are preprocessed once when the engine is built, and every query
+    batch is scored against all captions with a single ``process.cdist`` call
+    instead of one ``extractOne`` call per scene.
+    """
 
+    def __init__(self, captions, scorer=fuzz.WRatio, processor=None, workers=1, cache=None, version=None):
+        """
+        Args:
+            captions (dict): Dictionary of scene captions.
+            scorer (callable): rapidfuzz scorer used to compare queries and captions.
+            processor (callable): Optional preprocessing applied to captions and queries.
+            workers (int): Number of threads used by cdist (-1 uses all cores).
+            cache (QueryCache): Optional cache of rankings, which may be shared between engines
+                using the same scorer.
+            version (tuple): Version of the caption set, e.g. from caption_version; the cache is
+                only used when it is given.
+        """
+        self.scenes = list(captions.keys())
+        self.scorer = scorer
+        self.processor = processor
+        self.workers = workers
+        self.cache = cache if version is not None else None
+        self.version = version
+        if processor is not None:
+            self.choices = [processor(caption) for caption in captions.values()]
+        else:
+            self.choices = list(captions.values())
+
+    def __len__(self):
+        return len(self.scenes)
+
+    def score(self, queries, threshold=0):
+        """
+        Score every query against every caption.
+
+        Args:
+            queries (list): List of query strings.
+            threshold (float): Scores below this value are reported as 0.
+
+        Returns:
+            numpy.ndarray: Matrix of shape (len(queries), len(captions)).
+        """
+        if self.processor is not None:
+            queries = [self.processor(query) for query in queries]
+        return process.cdist(
+            queries,
+            self.choices,
+            scorer=self.scorer,
+            score_cutoff=threshold or None,
+            workers=self.workers,
+        )
+
+    def search_many(self, queries, threshold, limit=None):
+        """
+        Search the captions for several queries at once.
+
+        Args:
+            queries (list): List of query strings.
+            threshold (float): Similarity threshold (0-100).
+            limit (int): Maximum number of results per query (None for all).
+
+        Returns:
+            list: One list of (scene, score) tuples per query, best match first.
+        """
+        if not self.scenes:
+            return [[] for _ in queries]
+        results = [None] * len(queries)
+        if self.cache is not None:
+            # Cache keys are the queries as the scorer sees them
+            keys = [self.processor(query) if self.processor else query for query in queries]
+            for i, key in enumerate(keys):
+                results[i] = self.cache.get(key, threshold, self.version)
+        missing = [i for i, ranked in enumerate(results) if ranked is None]
+
+        if missing:
+            with profiler.stage("search", items=len(missing)):
+                scores = self.score([queries[i] for i in missing], threshold)
+                for i, row in zip(missing, scores):
+                    hits = np.flatnonzero(row >= threshold)
+                    # Stable sort keeps caption order for equal scores
+                    hits = hits[np.argsort(-row[hits], kind="stable")]
+                    results[i] = [(self.scenes[j], float(row[j])) for j in hits]
+                    if self.cache is not None:
+                        self.cache.put(keys[i], threshold, self.version, results[i])
+        return [ranked[:limit] if limit is not None else ranked for ranked in results]
+
+    def search(self, keyword, threshold, limit=None):
+        """
+        Search the captions for a single keyword.
+
+        Args:
+            keyword (str): Word to search for.
+            threshold (float): Similarity threshold (0-100).
+            limit (int): Maximum number of results (None for all).
+
+        Returns:
+            list: List of (scene, score) tuples, best match first.
+        """
+        return self.search_many([keyword], threshold, limit)[0]
+
+
+def search_captions_advanced(captions, keyword, threshold, cache=None, version=None):
+    """
+    Advanced search using rapidfuzz for keyword similarity in captions.
+
+    Args:
+        captions (dict): Dictionary of scene captions.
+        keyword (str): Word to search for.
+        threshold (float): Similarity threshold (0-100).
+        cache (QueryCache): Optional cache of rankings from earlier searches.
+        version (tuple): Version of the caption set (see caption_version); required to use the cache.
+
+    Returns:
+        list: List of scene numbers with captions matching the keyword.
+    """
+    use_cache = cache is not None and version is not None
+    ranked = cache.get(keyword, threshold, version) if use_cache else None
+    if ranked is None:
+        ranked = CaptionSearchEngine(captions).search(keyword, threshold)
+        if use_cache:
+            cache.put(keyword, threshold, version, ranked)
+    matched = {scene for scene, _ in ranked}
+    # Keep the original caption order for callers that rely on it
+    return [scene for scene in captions if scene in matched]
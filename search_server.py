@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import json
+import os
+import threading
+from urllib.parse import parse_qs, urlsplit
+from prompt_toolkit.document import Document
+from search_captions import CaptionCompleter, CaptionSearchEngine, QueryCache, caption_version, load_captions
+
+
+class _WarmIndex:
+    """Search engine and completer of one video, with the captions file state they were built from."""
+
+    def __init__(self, captions_file, query_cache=None):
+        self.version = caption_version(captions_file)
+        captions = load_captions(captions_file)
+        self.engine = CaptionSearchEngine(captions, cache=query_cache, version=self.version)
+        self.completer = CaptionCompleter(captions)
+
+
+class IndexRegistry:
+    """
+    Keeps the caption indexes of every video in a library warm in memory.
+
+    The library holds one folder per video with a scene_captions.json, as
+    written by batch_search.py. An index is rebuilt the first time it is used
+    after its captions file changed on disk.
+    """
+
+    def __init__(self, library, query_cache_size=1024):
+        """
+        Args:
+            library (str): Folder holding one sub-folder per video.
+            query_cache_size (int): Number of (query, video) rankings kept for repeated searches.
+        """
+        self.library = library
+        self.reloads = 0
+        self.query_cache = QueryCache(query_cache_size)
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._video_locks = {}
+
+    def videos(self):
+        """Return the ids of the videos that have captions."""
+        if not os.path.isdir(self.library):
+            return []
+        return sorted(
+            name for name in os.listdir(self.library)
+            if os.path.exists(os.path.join(self.library, name, "scene_captions.json"))
+        )
+
+    def get(self, video):
+        """
+        Return the warm index of a video, reloading it if its captions changed.
+
+        Raises:
+            KeyError: If the video has no captions in the library.
+        """
+        captions_file = os.path.join(self.library, os.path.basename(video), "scene_captions.json")
+        try:
+            version = caption_version(captions_file)
+        except OSError:
+            raise KeyError(video)
+        with self._lock:
+            # Requests run on worker threads; each video is loaded once even if several ask for it
+            video_lock = self._video_locks.setdefault(video, threading.Lock())
+        with video_lock:
+            index = self._indexes.get(video)
+            if index is None or index.version != version:
+                index = _WarmIndex(captions_file, self.query_cache)
+                with self._lock:
+                    self._indexes[video] = index
+                    self.reloads += 1
+        return index
+
+
+class SearchServer:
+    """
+    Minimal asyncio HTTP server exposing search and autocomplete over an IndexRegistry.
+
+    Endpoints (GET, JSON responses):
+        /videos
+        /search?q=<query>[&video=<id>][&threshold=60][&limit=20]
+        /complete?video=<id>&q=<text>
+    """
+
+    def __init__(self, registry, host="127.0.0.1", port=8765):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        """Start listening; returns the port actually bound (useful with port 0)."""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        print(f"Serving {len(self.registry.videos())} videos on http://{self.host}:{self.port}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Skip the headers; requests carry no body
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] != "GET":
+                status, body = 405, {"error": "Only GET is supported"}
+            else:
+                status, body = await self._route(parts[1])
+        except Exception as e:
+            status, body = 500, {"error": str(e)}
+        data = json.dumps(body).encode()
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}.get(status, "Error")
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data
+        )
+        await writer.drain()
+        writer.close()
+
+    async def _route(self, target):
+        url = urlsplit(target)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == "/videos":
+            return 200, {"videos": self.registry.videos()}
+        if url.path == "/search":
+            if "q" not in params:
+                return 400, {"error": "Missing q"}
+            videos = [params["video"]] if "video" in params else self.registry.videos()
+            try:
+                threshold = float(params.get("threshold", 60))
+                limit = int(params.get("limit", 20))
+            except ValueError as e:
+                return 400, {"error": f"Invalid threshold or limit: {e}"}
+            try:
+                # Scoring releases the GIL inside rapidfuzz, so it runs off the event loop
+                results = await asyncio.to_thread(self._search, videos, params["q"], threshold, limit)
+            except KeyError as e:
+                return 404, {"error": f"Unknown video {e}"}
+            return 200, {"results": results}
+        if url.path == "/complete":
+            try:
+                # Loading a cold index must not block the event loop
+                index = await asyncio.to_thread(self.registry.get, params.get("video", ""))
+            except KeyError as e:
+                return 404, {"error": f"Unknown video {e}"}
+            text = params.get("q", "")
+            completions = [c.text for c in index.completer.get_completions(Document(text), None)]
+            return 200, {"completions": completions}
+        return 404, {"error": f"Unknown path {url.path}"}
+
+    def _search(self, videos, query, threshold, limit):
+        results = []
+        for video in videos:
+            for scene, score in self.registry.get(video).engine.search(query, threshold, limit):
+                results.append({"video": video, "scene": scene, "score": round(score, 2)})
+        results.sort(key=lambda result: result["score"], reverse=True)
+        return results[:limit]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve caption search and autocomplete for a video library.")
+    parser.add_argument("--library", default="library", help="Folder with one sub-folder per video.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    server = SearchServer(IndexRegistry(args.library), args.host, args.port)
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == "__main__":
+    main()
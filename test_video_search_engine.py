@@ -1,3 +1,4 @@
+import os
 import subprocess
 import pytest
 import json
@@ -180,3 +181,1208 @@ def test_detect_scenes():
     
     # Assert the scenes are detected correctly
     assert scenes == [(0, 100), (101, 200)]
+
+
+# Test for the batched caption search engine
+def test_caption_search_engine():
+    """
+    Test that the batched search engine ranks scenes and matches the per-scene loop.
+    """
+    from search_captions import CaptionSearchEngine, search_captions_advanced
+
+    captions = {
+        "1": "A red car driving down the street.",
+        "2": "A group of people sitting in a park.",
+        "3": "A person playing a guitar on stage.",
+    }
+    engine = CaptionSearchEngine(captions)
+
+    # Batched queries return one ranked list per query
+    car_results, guitar_results = engine.search_many(["car", "guitar"], 60)
+    assert [scene for scene, _ in car_results] == ["1"]
+    assert [scene for scene, _ in guitar_results] == ["3"]
+    assert car_results[0][1] >= 60
+
+    # The compatible wrapper returns the same scenes as the old extractOne loop
+    for query in ["car", "park", "stage", "piano"]:
+        expected = mock_search_captions(captions, query, 60)
+        assert search_captions_advanced(captions, query, 60) == expected
+
+
+# Test for the BM25 caption index
+def test_caption_index(tmp_path):
+    """
+    Test BM25 ranking, fuzzy fallback, persistence and incremental updates.
+    """
+    from caption_index import CaptionIndex, load_or_build_index
+
+    captions = {
+        "1": "A red car driving down the street.",
+        "2": "A group of people sitting in a park.",
+        "3": "A person playing a guitar on stage.",
+    }
+    index_file = str(tmp_path / "scene_captions.index.json")
+    index = load_or_build_index(index_file, captions)
+
+    # Exact token matches, and a misspelled token falls back to fuzzy matching
+    assert [scene for scene, _ in index.search("guitar")] == ["3"]
+    assert [scene for scene, _ in index.search("gitar", threshold=70)] == ["3"]
+    assert index.search("piano") == []
+
+    # New scenes are added incrementally and persisted
+    captions["4"] = "A red guitar on a red car."
+    index = load_or_build_index(index_file, captions)
+    assert len(CaptionIndex.load(index_file)) == 4
+    assert [scene for scene, _ in index.search("red car")][0] == "4"
+
+    # Replacing a caption drops its old tokens
+    index.add("4", "A quiet lake.")
+    assert "4" not in [scene for scene, _ in index.search("guitar")]
+
+    # Changed and removed captions on disk are re-indexed
+    captions["1"] = "A sailing boat."
+    del captions["3"]
+    index = load_or_build_index(index_file, captions)
+    assert [scene for scene, _ in index.search("boat")] == ["1"]
+    assert index.search("car") != [] and "1" not in [scene for scene, _ in index.search("car")]
+    assert "3" not in index and len(CaptionIndex.load(index_file)) == 3
+
+
+# Test for caption auto-complete
+def test_caption_completer():
+    """
+    Test that completions are ranked by frequency, capped, and use the last word.
+    """
+    from prompt_toolkit.document import Document
+    from search_captions import CaptionCompleter
+
+    captions = {
+        "1": "A red car driving down the street.",
+        "2": "A red dress and a red door.",
+        "3": "A person reading on stage.",
+    }
+    completer = CaptionCompleter(captions, max_completions=2)
+
+    def complete(text):
+        return [c.text for c in completer.get_completions(Document(text), None)]
+
+    assert complete("re") == ["red", "reading"]
+    assert complete("d") == ["door", "down"]
+    assert complete("a red ca") == ["car"]
+    assert complete("zebra") == []
+
+    # The memo of prefix rankings is bounded and skips prefixes without words
+    completer = CaptionCompleter(captions, max_cached_prefixes=2)
+    for prefix in ("r", "re", "red", "xyz", "s"):
+        complete(prefix)
+    assert list(completer._ranked) == ["red", "s"]
+    completer.clear_cache()
+    assert complete("re") == ["red", "reading"] and list(completer._ranked) == ["re"]
+
+
+# Test for single-pass scene detection
+def test_detect_scenes_single_pass(tmp_path):
+    """
+    Test that capturing keyframes during detection matches the seek-based path.
+    """
+    import os
+    from benchmark import make_synthetic_video
+    from detect_scenes import detect_and_save_scenes
+
+    video_path = str(tmp_path / "video.mp4")
+    make_synthetic_video(video_path, [40, 50, 60, 45])
+    seek_scenes = detect_and_save_scenes(video_path, str(tmp_path / "seek"))
+    single_scenes = detect_and_save_scenes(video_path, str(tmp_path / "single"), single_pass=True)
+
+    assert single_scenes == seek_scenes
+    assert len(single_scenes) == 4
+    assert sorted(os.listdir(tmp_path / "single")) == sorted(os.listdir(tmp_path / "seek"))
+
+
+# Test for the fast scene detection mode
+def test_detect_scenes_fast_mode(tmp_path):
+    """
+    Test that frame skipping with refinement still finds every cut exactly.
+    """
+    import os
+    from benchmark import cut_recall, make_synthetic_video
+    from detect_scenes import detect_and_save_scenes
+
+    video_path = str(tmp_path / "video.mp4")
+    expected_cuts = make_synthetic_video(video_path, [41, 53, 60, 47, 38])
+    scenes = detect_and_save_scenes(
+        video_path, str(tmp_path / "fast"), single_pass=True, downscale=2, frame_skip=3, refine=True
+    )
+
+    assert cut_recall(expected_cuts, scenes, tolerance=0) == 1.0
+    assert len(os.listdir(tmp_path / "fast")) == len(scenes)
+
+
+# Test for parallel chunked scene detection
+def test_detect_scenes_parallel(tmp_path):
+    """
+    Test that detecting chunks in worker processes matches the sequential scene list.
+    """
+    import os
+    from benchmark import make_synthetic_video
+    from detect_scenes import detect_and_save_scenes
+    from profiling import profiler
+
+    video_path = str(tmp_path / "video.mp4")
+    make_synthetic_video(video_path, [41, 53, 60, 47, 38, 66, 29])
+    sequential = detect_and_save_scenes(video_path, str(tmp_path / "sequential"))
+    profiler.reset()
+    parallel = detect_and_save_scenes(video_path, str(tmp_path / "parallel"), workers=3)
+
+    # Overlap frames decoded by two chunks are counted once
+    assert profiler.stages["detect_scenes"]["items"] == parallel[-1][1].frame_num
+
+    assert len(parallel) == len(sequential)
+    for (start, end), (seq_start, seq_end) in zip(parallel, sequential):
+        assert abs(start.frame_num - seq_start.frame_num) <= 1
+        assert abs(end.frame_num - seq_end.frame_num) <= 1
+    assert sorted(os.listdir(tmp_path / "parallel")) == sorted(os.listdir(tmp_path / "sequential"))
+
+
+class FakeMoondreamModel:
+    """
+    Fake moondream model captioning images by their size.
+    """
+
+    def encode_image(self, image):
+        return image.size
+
+    def caption(self, encoded_image):
+        return {"caption": f"An image of size {encoded_image[0]}x{encoded_image[1]}."}
+
+
+def import_generate_captions(monkeypatch):
+    """
+    Import generate_captions with a fake moondream module.
+    """
+    import sys
+    import types
+
+    fake_moondream = types.ModuleType("moondream")
+    fake_moondream.vl = lambda model: FakeMoondreamModel()
+    monkeypatch.setitem(sys.modules, "moondream", fake_moondream)
+    import generate_captions
+
+    return generate_captions
+
+
+def make_scene_images(folder, sizes):
+    """
+    Write one JPEG scene image per size, numbered from 1.
+    """
+    from PIL import Image
+
+    folder.mkdir(exist_ok=True)
+    for scene, size in enumerate(sizes, start=1):
+        Image.new("RGB", size, (255, 0, 0)).save(folder / f"scene_{scene}.jpg")
+    return str(folder)
+
+
+# Test for pipelined caption generation
+def test_generate_captions_pipelined(tmp_path, monkeypatch):
+    """
+    Test that the pipelined mode captions every scene with prefetched, resized images.
+    """
+    generate_captions = import_generate_captions(monkeypatch)
+    folder = make_scene_images(tmp_path / "scene_images", [(100, 50), (2000, 1000), (300, 300)])
+    output_file = str(tmp_path / "scene_captions.json")
+
+    captions = generate_captions.generate_captions_pipelined(
+        folder, "model", output_file, batch_size=2, max_image_size=500
+    )
+
+    assert captions == {
+        "1": "An image of size 100x50.",
+        "2": "An image of size 500x250.",
+        "3": "An image of size 300x300.",
+    }
+    assert json.load(open(output_file)) == captions
+
+    # A failing model stops the decoding thread even though its queue is full
+    import threading
+
+    def failing_caption_batch(model, batch):
+        raise MemoryError("out of memory")
+
+    monkeypatch.setattr(generate_captions, "caption_batch", failing_caption_batch)
+    folder = make_scene_images(tmp_path / "more_images", [(100, 50)] * 6)
+    threads = threading.active_count()
+    with pytest.raises(RuntimeError, match="out of memory"):
+        generate_captions.generate_captions_pipelined(
+            folder, "model", str(tmp_path / "more.json"), batch_size=1, prefetch=1
+        )
+    assert threading.active_count() == threads
+
+
+# Test for resuming caption generation from the caption log
+def test_generate_captions_resume(tmp_path, monkeypatch):
+    """
+    Test that captions committed before a crash are kept and only the rest are captioned.
+    """
+    from caption_store import CaptionStore
+    from search_captions import load_captions
+
+    generate_captions = import_generate_captions(monkeypatch)
+    folder = make_scene_images(tmp_path / "scene_images", [(100, 50), (200, 50), (300, 50)])
+    output_file = str(tmp_path / "scene_captions.json")
+    log_file = str(tmp_path / "scene_captions.jsonl")
+
+    # Crash while captioning the third scene
+    captioned = []
+    caption = FakeMoondreamModel.caption
+
+    def crashing_caption(self, encoded_image):
+        if encoded_image[0] == 300 and not captioned:
+            captioned.append(encoded_image)
+            raise MemoryError("out of memory")
+        return caption(self, encoded_image)
+
+    monkeypatch.setattr(FakeMoondreamModel, "caption", crashing_caption)
+    with pytest.raises(RuntimeError):
+        generate_captions.generate_captions(folder, "model", output_file)
+    assert load_captions(log_file) == {
+        "1": "An image of size 100x50.",
+        "2": "An image of size 200x50.",
+    }
+
+    # A reader following the log sees only what is committed after it started
+    reader = CaptionStore(log_file)
+    reader.load()
+    captions = generate_captions.generate_captions(folder, "model", output_file)
+    assert reader.read_new() == {"3": "An image of size 300x50."}
+    assert len(captions) == 3
+
+
+# Test for the content-addressed caption cache
+def test_caption_cache(tmp_path, monkeypatch):
+    """
+    Test that another copy of the scenes is captioned from the cache, and a changed scene is not.
+    """
+    import shutil
+    import sys
+    from PIL import Image
+    from content_cache import ContentCache
+
+    generate_captions = import_generate_captions(monkeypatch)
+    first = tmp_path / "first"
+    first.mkdir()
+    Image.radial_gradient("L").convert("RGB").save(first / "scene_1.jpg")
+    Image.linear_gradient("L").rotate(90).convert("RGB").save(first / "scene_2.jpg")
+    first = str(first)
+    cache = ContentCache(str(tmp_path / "cache"))
+    captions = generate_captions.generate_captions(first, "model", str(tmp_path / "first.json"), cache=cache)
+    assert cache.stats()["misses"] == 2
+
+    # The same scenes, e.g. from a re-downloaded copy of the video, are byte-identical
+    second = tmp_path / "second"
+    second.mkdir()
+    for scene in (1, 2):
+        shutil.copy(tmp_path / "first" / f"scene_{scene}.jpg", second / f"scene_{scene}.jpg")
+
+    moondream = sys.modules["moondream"]
+    monkeypatch.setattr(moondream, "vl", None)  # The model must not be loaded
+    cached = generate_captions.generate_captions_pipelined(
+        str(second), "model", str(tmp_path / "second.json"), cache=cache
+    )
+    assert cached == captions
+    assert cache.stats()["hits"] == 2
+
+    # A scene that differs, however slightly, is captioned again instead of sharing a caption
+    third = tmp_path / "third"
+    shutil.copytree(second, third)
+    Image.open(second / "scene_2.jpg").save(third / "scene_2.jpg", quality=40)
+    monkeypatch.setattr(moondream, "vl", lambda model: FakeMoondreamModel())
+    generate_captions.generate_captions_pipelined(str(third), "model", str(tmp_path / "third.json"), cache=cache)
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 3
+
+
+# Test for LRU eviction in the content cache
+def test_content_cache_eviction(tmp_path):
+    """
+    Test that the least recently used entries are evicted once the cache is full.
+    """
+    import os
+    import time
+    from content_cache import ContentCache
+
+    cache = ContentCache(str(tmp_path), max_bytes=30)
+    cache.set("gemini", "a", ["00:00:01"])
+    cache.set("gemini", "b", ["00:00:02"])
+    time.sleep(0.01)
+    assert cache.get("gemini", "a") == ["00:00:01"]  # "a" is now the most recently used
+    for file in os.listdir(tmp_path):
+        if file.endswith(".json") and file != cache._file("gemini", "a"):
+            os.utime(tmp_path / file, (0, 0))
+    cache.set("gemini", "c", ["00:00:03"])
+
+    assert cache.get("gemini", "b") is None
+    assert cache.get("gemini", "a") == ["00:00:01"]
+    assert cache.stats()["entries"] == 2
+
+
+def import_gemini_api(monkeypatch, fake_genai=None):
+    """
+    Import gemini_api with a fake google.generativeai module.
+    """
+    import sys
+    import types
+
+    fake_google = types.ModuleType("google")
+    fake_genai = fake_genai or types.ModuleType("google.generativeai")
+    fake_genai.configure = getattr(fake_genai, "configure", lambda **kwargs: None)
+    fake_google.generativeai = fake_genai
+    monkeypatch.setitem(sys.modules, "google", fake_google)
+    monkeypatch.setitem(sys.modules, "google.generativeai", fake_genai)
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    import gemini_api
+
+    monkeypatch.setattr(gemini_api, "genai", fake_genai)
+    return gemini_api
+
+
+# Test for batch frame extraction
+def test_extract_frames_batch(tmp_path, monkeypatch):
+    """
+    Test that frames are extracted in one pass and returned in input order.
+    """
+    import cv2
+    from benchmark import make_synthetic_video
+
+    gemini_api = import_gemini_api(monkeypatch)
+    video_path = str(tmp_path / "video.mp4")
+    make_synthetic_video(video_path, [50, 50, 50, 50], fps=10)
+
+    timestamps = ["00:00:15", "00:00:02", "00:00:07", "00:00:02", "00:01:00"]
+    frames = gemini_api.extract_frames_batch(timestamps, str(tmp_path / "frames"), video_path)
+
+    # The timestamp past the end of the video is skipped
+    assert [os.path.basename(frame) for frame in frames] == [
+        "frame_000.jpg", "frame_001.jpg", "frame_002.jpg", "frame_003.jpg"
+    ]
+    cap = cv2.VideoCapture(video_path)
+    for frame_path, frame_num in zip(frames, [150, 20, 70, 20]):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+        expected = cv2.imread(frame_path).astype(int)
+        assert abs(cap.read()[1].astype(int) - expected).mean() < 5
+
+
+class FakeGenai:
+    """
+    Local fake of the google.generativeai module.
+
+    Uploaded files are processing for a few polls, and the model answers
+    with a timestamp derived from the query.
+    """
+
+    def __init__(self, processing_polls=2, delay=0.02):
+        import threading
+        import types
+
+        self.module = types.ModuleType("google.generativeai")
+        self.module.configure = lambda **kwargs: None
+        self.module.upload_file = self.upload_file
+        self.module.get_file = self.get_file
+        self.module.GenerativeModel = self.GenerativeModel
+        self.processing_polls = processing_polls
+        self.delay = delay
+        self.uploaded = []
+        self.polls = {}
+        self.active_queries = 0
+        self.max_active_queries = 0
+        self.lock = threading.Lock()
+
+    def _file(self, name, state):
+        import types
+
+        return types.SimpleNamespace(
+            name=name, display_name=name, uri=f"fake://{name}", state=types.SimpleNamespace(name=state)
+        )
+
+    def upload_file(self, path, mime_type=None):
+        name = f"files/{len(self.uploaded)}"
+        self.uploaded.append(path)
+        self.polls[name] = 0
+        return self._file(name, "PROCESSING")
+
+    def get_file(self, name):
+        self.polls[name] += 1
+        return self._file(name, "ACTIVE" if self.polls[name] >= self.processing_polls else "PROCESSING")
+
+    def GenerativeModel(self, model_name, generation_config):
+        import time
+        import types
+
+        def send_message(prompt):
+            with self.lock:
+                self.active_queries += 1
+                self.max_active_queries = max(self.max_active_queries, self.active_queries)
+            time.sleep(self.delay)
+            with self.lock:
+                self.active_queries -= 1
+            query = prompt["parts"][0].split("'")[1]
+            return types.SimpleNamespace(text=f"'{query}' appears at 00:00:{len(query):02d}.")
+
+        chat = types.SimpleNamespace(send_message=send_message)
+        return types.SimpleNamespace(start_chat=lambda history: chat)
+
+
+# Test for the asynchronous Gemini session
+def test_gemini_session(tmp_path, monkeypatch):
+    """
+    Test that a video is uploaded once and queries run concurrently up to the limit.
+    """
+    import asyncio
+
+    fake = FakeGenai()
+    gemini_api = import_gemini_api(monkeypatch, fake.module)
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"fake video")
+
+    hashed = []
+    file_hash = gemini_api.file_hash
+    monkeypatch.setattr(gemini_api, "file_hash", lambda path: hashed.append(path) or file_hash(path))
+
+    session = gemini_api.GeminiSession(max_concurrency=2, poll_initial=0.001)
+    queries = ["cat", "dog", "mario", "a red car", "luigi"]
+    results = asyncio.run(session.ask_many(str(video_path), queries))
+
+    assert results == {query: [f"00:00:{len(query):02d}"] for query in queries}
+    assert fake.uploaded == [str(video_path)]
+    assert fake.max_active_queries == 2
+
+    # The upload is reused by later queries on the same content
+    asyncio.run(session.ask(str(video_path), "peach"))
+    asyncio.run(session.ask(str(video_path), "toad"))
+    assert session.uploads == 1
+
+    # The video is hashed once, not once per query
+    assert hashed == [str(video_path)]
+
+
+# Test for the CLI cold-start budget
+def test_main_startup_is_lazy():
+    """
+    Test that importing main loads no heavy dependency and stays within the startup budget.
+    """
+    import sys
+
+    heavy_modules = ["cv2", "scenedetect", "moondream", "google.generativeai", "yt_dlp", "PIL", "rapidfuzz"]
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         f"import sys, main; print([m for m in {heavy_modules!r} if m in sys.modules])"],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    assert result.stdout.strip() == "[]"
+
+    # Each -X importtime line is "import time: self_us | cumulative_us | module"
+    main_line = [line for line in result.stderr.splitlines() if line.endswith("| main")][0]
+    cumulative_us = int(main_line.split("|")[1])
+    assert cumulative_us < 100_000
+
+
+# Test for lazy Gemini configuration
+def test_gemini_requires_key_only_when_used(monkeypatch, tmp_path):
+    """
+    Test that gemini_api imports without GEMINI_API_KEY and fails clearly on first use.
+    """
+    gemini_api = import_gemini_api(monkeypatch, FakeGenai().module)
+    monkeypatch.delenv("GEMINI_API_KEY")
+    monkeypatch.setattr(gemini_api, "_configured", False)
+
+    with pytest.raises(RuntimeError, match="GEMINI_API_KEY"):
+        gemini_api.upload_to_gemini(str(tmp_path / "video.mp4"))
+
+
+# Test for the batch query CLI
+def test_batch_search(tmp_path):
+    """
+    Test that all queries run against all prepared videos and stream JSONL results.
+    """
+    from batch_search import main as batch_main, video_dir_for
+
+    library = tmp_path / "library"
+    videos = {
+        "trailer.mp4": {"1": "A red car driving down the street.", "2": "A man playing a guitar."},
+        "movie.mp4": {"1": "A guitar on a stage.", "2": "A dog in a park.", "3": "A red car parked."},
+    }
+    for video, captions in videos.items():
+        video_dir = video_dir_for(str(library), str(tmp_path / video))
+        os.makedirs(os.path.join(video_dir, "scene_images"))
+        open(os.path.join(video_dir, "scene_images", "scene_1.jpg"), "wb").close()
+        with open(os.path.join(video_dir, "scene_captions.json"), "w") as f:
+            json.dump(captions, f)
+        timeline = {scene: {"start_frame": 0, "end_frame": 0, "start": 65.0 * int(scene), "end": 0}
+                    for scene in captions}
+        with open(os.path.join(video_dir, "scene_images.timeline.json"), "w") as f:
+            json.dump({"video": None, "scenes": timeline}, f)
+
+    queries_file = tmp_path / "queries.txt"
+    queries_file.write_text("guitar\nred car\n\npiano\n")
+    output_file = tmp_path / "results.jsonl"
+    batch_main([
+        "--videos", str(tmp_path / "trailer.mp4"), str(tmp_path / "movie.mp4"),
+        "--queries", str(queries_file), "--library", str(library),
+        "--output", str(output_file), "--threshold", "80", "--limit", "1",
+    ])
+
+    results = [json.loads(line) for line in output_file.read_text().splitlines()]
+    assert [(os.path.basename(r["video"]), r["query"], r["scene"], r["timestamp"]) for r in results] == [
+        ("trailer.mp4", "guitar", "2", "00:02:10"),
+        ("trailer.mp4", "red car", "1", "00:01:05"),
+        ("movie.mp4", "guitar", "1", "00:01:05"),
+        ("movie.mp4", "red car", "3", "00:03:15"),
+    ]
+
+
+# Test for the local search server
+def test_search_server(tmp_path):
+    """
+    Test search and autocomplete endpoints and reloading of changed captions.
+    """
+    import asyncio
+    from search_server import IndexRegistry, SearchServer
+
+    video_dir = tmp_path / "trailer"
+    video_dir.mkdir()
+    captions_file = video_dir / "scene_captions.json"
+    captions_file.write_text(json.dumps({"1": "A red car.", "2": "A man playing a guitar."}))
+
+    async def get(port, target):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        head, body = response.split(b"\r\n\r\n", 1)
+        return int(head.split()[1]), json.loads(body)
+
+    async def scenario():
+        registry = IndexRegistry(str(tmp_path))
+        server = SearchServer(registry, port=0)
+        port = await server.start()
+        try:
+            assert await get(port, "/videos") == (200, {"videos": ["trailer"]})
+            status, body = await get(port, "/search?q=guitar&threshold=80")
+            assert [r["scene"] for r in body["results"]] == ["2"]
+            # Concurrent requests share the warm index
+            responses = await asyncio.gather(*(get(port, "/complete?video=trailer&q=a%20gu") for _ in range(5)))
+            assert all(body == {"completions": ["guitar"]} for _, body in responses)
+            assert registry.reloads == 1
+
+            # Captions changed on disk are picked up by the next request
+            captions_file.write_text(json.dumps({"1": "A red car.", "2": "A man playing a guitar.", "3": "A guitar shop."}))
+            status, body = await get(port, "/search?video=trailer&q=guitar&threshold=80")
+            assert sorted(r["scene"] for r in body["results"]) == ["2", "3"]
+            assert registry.reloads == 2
+
+            assert (await get(port, "/search?video=missing&q=car"))[0] == 404
+            assert (await get(port, "/search?q=car&limit=ten"))[0] == 400
+        finally:
+            await server.close()
+
+    asyncio.run(scenario())
+
+
+# Test for the streaming detect -> caption -> index pipeline
+def test_streaming_pipeline(tmp_path, monkeypatch):
+    """
+    Test that scenes are captioned and indexed while detection runs.
+    """
+    from benchmark import make_synthetic_video
+    from caption_index import CaptionIndex
+    from pipeline import StreamingPipeline
+
+    import_generate_captions(monkeypatch)
+    video_path = str(tmp_path / "video.mp4")
+    make_synthetic_video(video_path, [40, 50, 60, 45], size=(320, 240))
+
+    pipeline = StreamingPipeline(
+        video_path, str(tmp_path / "scene_images"), "model", str(tmp_path / "scene_captions.json"),
+        str(tmp_path / "scene_captions.index.json"), queue_size=2, batch_size=2,
+    )
+    captions = pipeline.run()
+
+    assert sorted(captions) == ["1", "2", "3", "4"]
+    assert all(caption == "An image of size 320x240." for caption in captions.values())
+    assert pipeline.first_searchable is not None
+    assert [scene for scene, _ in pipeline.search("320x240")] != []
+    assert len(CaptionIndex.load(str(tmp_path / "scene_captions.index.json"))) == 4
+    assert json.load(open(tmp_path / "scene_captions.json")) == captions
+
+
+# Test for the streaming collage builder
+def test_create_collage_streaming(tmp_path):
+    """
+    Test paginated streaming collages and that missing images are skipped.
+    """
+    from PIL import Image
+    from create_collage import create_collage, create_collage_streaming
+
+    folder = make_scene_images(tmp_path / "scene_images", [(800, 600)] * 7)
+    image_paths = [os.path.join(folder, f"scene_{scene}.jpg") for scene in range(1, 8)]
+    image_paths.insert(2, os.path.join(folder, "missing.jpg"))
+
+    pages = create_collage_streaming(
+        image_paths, str(tmp_path / "collage.png"), thumbnail_size=(100, 100), workers=2, max_per_page=3
+    )
+    assert [os.path.basename(page) for page in pages] == ["collage_001.png", "collage_002.png", "collage_003.png"]
+    assert [Image.open(page).size for page in pages] == [(200, 100), (200, 200), (200, 100)]
+
+    # A single page has the same layout as create_collage
+    create_collage(image_paths, str(tmp_path / "single.png"), thumbnail_size=(100, 100), show=False)
+    single = create_collage_streaming(image_paths, str(tmp_path / "streamed.png"), thumbnail_size=(100, 100))
+    assert Image.open(single[0]).size == Image.open(tmp_path / "single.png").size
+
+    # The grid is sized from the images that loaded, not from every path
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not an image")
+    image_paths = image_paths[:2] + [str(broken), str(broken)]
+    create_collage(image_paths, str(tmp_path / "single.png"), thumbnail_size=(100, 100), show=False)
+    single = create_collage_streaming(image_paths, str(tmp_path / "streamed.png"), thumbnail_size=(100, 100))
+    assert Image.open(single[0]).size == Image.open(tmp_path / "single.png").size == (200, 100)
+
+
+def test_thumbnail_cache(tmp_path):
+    """
+    Test that collage tiles are reused across queries and invalidated when the source changes.
+    """
+    from PIL import Image
+    from thumbnail_cache import ThumbnailCache
+    from create_collage import create_collage_streaming
+
+    folder = make_scene_images(tmp_path / "scene_images", [(800, 600)] * 3)
+    image_paths = [os.path.join(folder, f"scene_{scene}.jpg") for scene in range(1, 4)]
+    cache = ThumbnailCache(str(tmp_path / "thumbnails"))
+
+    # Tiles produced eagerly are hits for every later collage
+    for image_path in image_paths:
+        cache.put(image_path, (100, 100))
+    for _ in range(2):
+        create_collage_streaming(image_paths, str(tmp_path / "collage.png"), thumbnail_size=(100, 100),
+                                 thumbnail_cache=cache)
+    assert (cache.hits, cache.misses) == (6, 0)
+    assert cache.get(image_paths[0], (100, 100)).size == (100, 75)
+
+    # A different size is a separate tile
+    cache.get(image_paths[0], (50, 50))
+    assert cache.misses == 1
+
+    # Rewriting the source replaces its tile
+    Image.new("RGB", (400, 400), "blue").save(image_paths[0])
+    stat = os.stat(image_paths[0])
+    os.utime(image_paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get(image_paths[0], (100, 100)).size == (100, 100)
+    assert cache.misses == 2
+    assert len(os.listdir(tmp_path / "thumbnails")) == 4
+
+    # Past max_bytes the least recently used tiles are evicted
+    sizes = [os.path.getsize(cache._tile_path(image_path, (100, 100))) for image_path in image_paths]
+    cache = ThumbnailCache(str(tmp_path / "small"), max_bytes=2 * max(sizes))
+    cache.put(image_paths[1], (100, 100))
+    cache.put(image_paths[2], (100, 100))
+    cache.get(image_paths[1], (100, 100))
+    cache.put(image_paths[0], (100, 100))
+    assert os.path.exists(cache._tile_path(image_paths[1], (100, 100)))
+    assert not os.path.exists(cache._tile_path(image_paths[2], (100, 100)))
+
+
+# Test for the columnar scene store
+def test_scene_store(tmp_path):
+    """
+    Test that the scene store round-trips every column, is memory-mapped and follows caption changes.
+    """
+    import numpy as np
+    from scene_store import load_or_build_scene_store, store_dir_for
+    from search_captions import load_captions
+
+    captions = {"10": "A red car.", "2": "Ein Hund im Park.", "3": ""}
+    captions_file = tmp_path / "scene_captions.json"
+    captions_file.write_text(json.dumps(captions))
+    image_folder = tmp_path / "scene_images"
+    image_folder.mkdir()
+    timeline = {"2": {"start_frame": 50, "end_frame": 75, "start": 2.0, "end": 3.0}}
+    (tmp_path / "scene_images.timeline.json").write_text(json.dumps({"video": None, "scenes": timeline}))
+
+    store = load_or_build_scene_store(str(captions_file), str(image_folder))
+    assert isinstance(store.columns["caption_data"], np.memmap)
+    assert len(store) == 3
+    assert store.captions() == captions
+    assert store.captions()["2"] == "Ein Hund im Park." and "4" not in store.captions()
+    assert store.column("caption")[-1] == "A red car."
+    assert list(store.captions().values()) == ["Ein Hund im Park.", "", "A red car."]
+    assert store.row(store.find(2)) == {
+        "scene": 2, "start": 2.0, "end": 3.0, "image_path": os.path.join(str(image_folder), "scene_2.jpg"),
+        "caption": "Ein Hund im Park.", "tokens": ["ein", "hund", "im", "park"],
+    }
+    assert store.times(store.find("10")) is None
+    assert store.tokens(store.find(3)) == []
+    assert store.find(4) is None
+    assert load_captions(store_dir_for(str(captions_file))) == captions
+
+    # The store is reused until the captions change
+    assert load_or_build_scene_store(str(captions_file), str(image_folder)).meta == store.meta
+    captions["11"] = "A blue car."
+    captions_file.write_text(json.dumps(captions))
+    store = load_or_build_scene_store(str(captions_file), str(image_folder))
+    assert store.caption(store.find(11)) == "A blue car."
+
+
+class FakeEncoder:
+    """
+    Fake embedding model mapping related words to the same dimension.
+    """
+
+    concepts = {"plumber": 0, "overalls": 0, "dog": 1, "puppy": 1, "car": 2, "100x50": 3, "red": 4}
+
+    def __init__(self):
+        self.encoded = 0
+
+    def encode_text(self, texts):
+        import numpy as np
+        from search_captions import tokenize
+
+        self.encoded += len(texts)
+        vectors = np.zeros((len(texts), 8))
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                if token in self.concepts:
+                    vectors[row, self.concepts[token]] += 1
+        return vectors
+
+    def encode_images(self, image_paths):
+        import numpy as np
+
+        self.encoded += len(image_paths)
+        vectors = np.zeros((len(image_paths), 8))
+        vectors[:, self.concepts["red"]] = 1
+        return vectors
+
+
+# Test for embedding search
+def test_embedding_search(tmp_path, monkeypatch):
+    """
+    Test semantic ranking, keyframe vectors, incremental updates and the approximate index.
+    """
+    import numpy as np
+    from embedding_search import CaptionEmbedder, EmbeddingIndex
+
+    generate_captions = import_generate_captions(monkeypatch)
+    folder = make_scene_images(tmp_path / "scene_images", [(100, 50), (200, 50)])
+    encoder = FakeEncoder()
+    embedder = CaptionEmbedder(str(tmp_path / "embeddings.npz"), encoder, folder)
+
+    # Vectors are computed at caption time, for captions and keyframes
+    generate_captions.generate_captions(folder, "model", str(tmp_path / "scene_captions.json"), embedder=embedder)
+    assert encoder.encoded == 4
+
+    captions = {"1": "An image of size 100x50.", "2": "An image of size 200x50.",
+                "3": "A man in overalls.", "4": "A dog in a park."}
+    index = embedder.update(captions)
+    assert encoder.encoded == 6
+    assert len(index) == 4 and index.vectors.flags["C_CONTIGUOUS"]
+    assert embedder.update(captions).scenes == index.scenes and encoder.encoded == 6
+
+    results = index.search_text(encoder, ["plumber", "puppy", "red"], limit=2, min_score=0.5)
+    assert [[scene for scene, _ in matches] for matches in results] == [["3"], ["4"], ["1", "2"]]
+    assert results[0][0][1] == pytest.approx(1.0)
+
+    # Changed captions are embedded again and removed scenes are no longer found
+    captions["4"] = "A red car."
+    del captions["3"]
+    index = embedder.update(captions)
+    assert encoder.encoded == 10 and len(index) == 3
+    assert embedder.update(captions).caption_digests == index.caption_digests and encoder.encoded == 10
+    assert [scene for scene, _ in index.search_text(encoder, ["car"], limit=1, min_score=0.5)[0]] == ["4"]
+    assert index.search_text(encoder, ["plumber"], min_score=0.5) == [[]]
+
+    # The approximate index finds the nearest neighbours of slightly perturbed vectors
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2000, 32))
+    large = EmbeddingIndex()
+    large.add(range(2000), vectors)
+    large.build_approximate(num_bits=8, num_tables=8)
+    queries = vectors[:50] + 0.05 * rng.standard_normal((50, 32))
+    exact = [matches[0][0] for matches in large.search(queries, limit=1)]
+    approximate = [matches[0][0] if matches else None for matches in large.search(queries, limit=1, approximate=True)]
+    assert exact == [str(i) for i in range(50)]
+    assert sum(a == e for a, e in zip(approximate, exact)) >= 45
+
+
+# Test for per-stage profiling
+def test_profiling(tmp_path):
+    """
+    Test stage timers, counters, the JSON report and cProfile of a single stage.
+    """
+    import pstats
+    import threading
+    from profiling import Profiler
+
+    profiler = Profiler()
+    profiler.reset(trace_memory=True, cprofile_stage="caption", cprofile_file=str(tmp_path / "caption.prof"))
+
+    def caption_scenes():
+        with profiler.stage("caption") as record:
+            record["items"] = len([str(i) for i in range(10000)])
+
+    with profiler.stage("detect_scenes", items=250):
+        threads = [threading.Thread(target=caption_scenes) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    profiler.count("caption_cache_hits", 2)
+
+    report_file = tmp_path / "report.json"
+    profiler.save_report(str(report_file))
+    report = json.loads(report_file.read_text())
+    assert report["stages"]["caption"]["calls"] == 3
+    assert report["stages"]["caption"]["items"] == 30000
+    assert report["stages"]["detect_scenes"]["items"] == 250
+    assert report["stages"]["detect_scenes"]["seconds"] >= report["stages"]["caption"]["seconds"] / 3
+    assert report["stages"]["caption"]["items_per_second"] > 0
+    assert report["stages"]["caption"]["peak_traced_bytes"] > 0
+    assert report["counters"] == {"caption_cache_hits": 2}
+    assert report["cprofile"]["stage"] == "caption"
+    assert pstats.Stats(str(tmp_path / "caption.prof")).total_calls > 0
+
+    profiler.reset()
+    assert profiler.report()["stages"] == {} and profiler.report()["peak_traced_bytes"] is None
+
+
+# Test for the benchmark suite
+def test_benchmark_suite(monkeypatch):
+    """
+    Test that the suite times every component on reproducible inputs and flags regressions.
+    """
+    from benchmark import find_regressions, make_caption_corpus, run_suite
+
+    import_gemini_api(monkeypatch)
+    assert make_caption_corpus(50) == make_caption_corpus(50)
+    assert len(make_caption_corpus(1000)) == 1000
+
+    run = run_suite(corpus_sizes=[200], num_scenes=3, video_size=(160, 120),
+                    detection_configs={"single_pass": {"single_pass": True}}, repeat=1)
+    assert set(run["results"]) >= {
+        "detect_and_save_scenes/single_pass", "search_captions_advanced/200", "completer_build/200",
+        "get_completions/200", "create_collage/64", "extract_frames_batch/20",
+    }
+    assert run["detection"]["single_pass"]["recall"] == 1.0
+
+    baseline = {"search/1000": {"best": 0.010}, "collage/64": {"best": 0.5}, "removed": {"best": 1.0}}
+    results = {"search/1000": {"best": 0.020}, "collage/64": {"best": 0.55}, "added": {"best": 1.0}}
+    assert find_regressions(results, baseline) == [
+        {"benchmark": "search/1000", "baseline": 0.010, "current": 0.020, "ratio": 2.0}
+    ]
+
+
+# Test for the query result cache
+def test_query_cache(tmp_path):
+    """
+    Test cached rankings, reuse for tighter thresholds, LRU eviction and invalidation on caption changes.
+    """
+    from search_captions import CaptionSearchEngine, QueryCache, caption_version, search_captions_advanced
+
+    captions = {"1": "A red car on a road.", "2": "A red cat on a mat.", "3": "A blue bus.", "4": "A cart."}
+    captions_file = tmp_path / "scene_captions.json"
+    captions_file.write_text(json.dumps(captions))
+    version = caption_version(str(captions_file))
+    cache = QueryCache(max_entries=2)
+    engine = CaptionSearchEngine(captions, cache=cache, version=version)
+    scored = []
+    score = engine.score
+    engine.score = lambda queries, threshold=0: scored.append(list(queries)) or score(queries, threshold)
+
+    loose = engine.search("car", 40)
+    assert engine.search("car", 40, limit=1) == loose[:1]
+    tight = engine.search("car", 70)
+    assert tight == CaptionSearchEngine(captions).search("car", 70) and len(tight) < len(loose)
+    assert scored == [["car"]]
+
+    # A looser threshold than the cached one is searched again
+    engine.search("car", 20)
+    assert scored == [["car"], ["car"]]
+
+    # Batches only score the queries that are not cached; the oldest entry is evicted
+    engine.search_many(["car", "bus", "mat"], 60)
+    assert scored[-1] == ["bus", "mat"] and len(cache) == 2
+    engine.search("car", 60)
+    assert scored[-1] == ["car"]
+
+    # Rewriting the captions file changes the version, so old rankings are not reused
+    captions["5"] = "A car wash."
+    tmp_file = tmp_path / "scene_captions.json.tmp"
+    tmp_file.write_text(json.dumps(captions))
+    os.replace(tmp_file, captions_file)
+    new_version = caption_version(str(captions_file))
+    assert new_version != version
+    assert "5" in search_captions_advanced(captions, "car", 60, cache, new_version)
+    hits = cache.hits
+    assert search_captions_advanced(captions, "car", 90, cache, new_version) == \
+        search_captions_advanced(captions, "car", 90)
+    assert cache.hits == hits + 1
+
+
+# Test for mapping Gemini timestamps onto scene keyframes
+def test_frames_for_timestamps(tmp_path, monkeypatch):
+    """
+    Test that timestamps in known scenes reuse keyframes and only the rest are decoded.
+    """
+    from benchmark import make_synthetic_video
+    from detect_scenes import scene_at
+
+    gemini_api = import_gemini_api(monkeypatch)
+    video_path = str(tmp_path / "video.mp4")
+    make_synthetic_video(video_path, [50, 50, 50, 50], fps=10)
+    scene_images = make_scene_images(tmp_path / "scene_images", [(64, 48)])
+    timeline = {
+        "1": {"start_frame": 0, "end_frame": 50, "start": 0.0, "end": 5.0},
+        "2": {"start_frame": 50, "end_frame": 100, "start": 5.0, "end": 10.0},
+    }
+    timeline_file = tmp_path / "scene_images.timeline.json"
+    stat = os.stat(video_path)
+    timeline_file.write_text(json.dumps({"video": [stat.st_size, stat.st_mtime_ns], "scenes": timeline}))
+    assert [scene_at(timeline, s) for s in (0, 4.9, 5.0, 10.0)] == ["1", "1", "2", None]
+
+    decoded = []
+    extract_frames_batch = gemini_api.extract_frames_batch
+    monkeypatch.setattr(gemini_api, "extract_frames_batch",
+                        lambda times, *args: decoded.extend(times) or extract_frames_batch(times, *args))
+
+    # Scene 2 has no keyframe on disk and 00:00:15 is outside the timeline
+    frames = gemini_api.frames_for_timestamps(
+        ["00:00:03", "00:00:07", "00:00:01", "00:00:15"], str(tmp_path / "frames"), video_path, scene_images
+    )
+    assert decoded == ["00:00:07", "00:00:15"]
+    assert frames == [
+        os.path.join(scene_images, "scene_1.jpg"),
+        str(tmp_path / "frames" / "frame_000.jpg"),
+        str(tmp_path / "frames" / "frame_001.jpg"),
+    ]
+
+    # Keyframes detected in another video are never reused
+    timeline_file.write_text(json.dumps({"video": [stat.st_size + 1, stat.st_mtime_ns], "scenes": timeline}))
+    decoded.clear()
+    gemini_api.frames_for_timestamps(["00:00:03"], str(tmp_path / "frames"), video_path, scene_images)
+    assert decoded == ["00:00:03"]
+
+
+# Test for sharded Gemini analysis
+def test_gemini_sharded(tmp_path, monkeypatch):
+    """
+    Test that segments are queried concurrently and their timestamps merged in global time.
+    """
+    import shutil
+
+    fake = FakeGenai(processing_polls=1)
+    gemini_api = import_gemini_api(monkeypatch, fake.module)
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"long video")
+
+    def fake_splitter(path, segment_folder, segment_seconds):
+        os.makedirs(segment_folder, exist_ok=True)
+        segments = []
+        for i, start in enumerate([0.0, 58.5, 119.0]):
+            segment = os.path.join(segment_folder, f"segment_{i:03d}.mp4")
+            with open(segment, "wb") as f:
+                f.write(f"segment {i}".encode())
+            segments.append((segment, start))
+        return segments
+
+    matches = gemini_api.search_in_gemini_sharded(
+        str(video_path), "cat", segment_seconds=60, max_concurrency=3,
+        segment_folder=str(tmp_path / "segments"), splitter=fake_splitter,
+    )
+    # The fake answers 00:00:03 for "cat" in every segment
+    assert matches == ["00:00:03", "00:01:02", "00:02:02"]
+    assert len(fake.uploaded) == 3 and fake.max_active_queries == 3
+
+    assert gemini_api.merge_timestamps([61.0, 10.0, 60.4, 10.0, 30.0]) == ["00:00:10", "00:00:30", "00:01:00"]
+
+    if shutil.which("ffmpeg"):
+        from benchmark import make_synthetic_video
+
+        make_synthetic_video(str(video_path), [50] * 4, fps=10)
+        segments = gemini_api.split_video(str(video_path), str(tmp_path / "ffmpeg_segments"), segment_seconds=5)
+        assert segments[0][1] == 0.0 and all(os.path.exists(path) for path, _ in segments)
+
+
+# Test for the media cache
+def test_media_cache(tmp_path):
+    """
+    Test concurrent downloads, resuming partial files and reuse of cached videos, over local HTTP.
+    """
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from media_cache import HttpDownloader, MediaCache, format_for_height
+
+    videos = {"/a.mp4": os.urandom(300000), "/b.mp4": os.urandom(200000), "/c.mp4": os.urandom(1000)}
+    ranges = []
+
+    class RangeHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            data = videos[self.path]
+            start = int(self.headers["Range"][len("bytes="):-1]) if self.headers["Range"] else 0
+            ranges.append((self.path, start))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.end_headers()
+                return
+            self.send_response(206 if start else 200)
+            self.send_header("Content-Length", str(len(data) - start))
+            self.end_headers()
+            self.wfile.write(data[start:])
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    downloader = HttpDownloader(chunk_size=4096)
+    try:
+        cache = MediaCache(str(tmp_path / "media"), downloader=downloader)
+
+        # An interrupted download of a.mp4 left its first 100000 bytes behind
+        part = cache.video_path(downloader.resolve(f"{base}/a.mp4")["id"]) + ".part"
+        with open(part, "wb") as f:
+            f.write(videos["/a.mp4"][:100000])
+
+        paths = cache.fetch_many([f"{base}/a.mp4", f"{base}/b.mp4", f"{base}/a.mp4"], workers=3)
+        assert sorted(ranges) == [("/a.mp4", 100000), ("/b.mp4", 0)]
+        for source, path in paths.items():
+            with open(path, "rb") as f:
+                assert f.read() == videos[source[len(base):]]
+        meta = cache.metadata(downloader.resolve(f"{base}/b.mp4")["id"])
+        assert meta["size"] == 200000 and meta["max_height"] == 480 and meta["title"] == "b"
+
+        # A .part file that is already complete is renamed when the server answers 416
+        part = cache.video_path(downloader.resolve(f"{base}/c.mp4")["id"]) + ".part"
+        with open(part, "wb") as f:
+            f.write(videos["/c.mp4"])
+        with open(cache.fetch(f"{base}/c.mp4"), "rb") as f:
+            assert f.read() == videos["/c.mp4"]
+        ranges.remove(("/c.mp4", 1000))
+    finally:
+        server.shutdown()
+
+    # Later runs find the videos by source without the network
+    cache = MediaCache(str(tmp_path / "media"), downloader=downloader)
+    assert cache.fetch(f"{base}/b.mp4") == paths[f"{base}/b.mp4"]
+    assert len(ranges) == 2
+    # A video downloaded under another resolution cap is not reused
+    assert MediaCache(str(tmp_path / "media"), max_height=720, downloader=downloader).get(f"{base}/b.mp4") is None
+    assert format_for_height(480) == "best[height<=480][ext=mp4]/best[height<=480]/worst"
+
+
+# Test for search_captions_advanced starting from an empty query cache
+def test_query_cache_starts_empty(tmp_path):
+    """
+    Test that an empty cache is filled by the first search and hit by the second.
+    """
+    from search_captions import QueryCache, caption_version, search_captions_advanced
+
+    captions = {"1": "A red car.", "2": "A blue bus."}
+    captions_file = tmp_path / "scene_captions.json"
+    captions_file.write_text(json.dumps(captions))
+    version = caption_version(str(captions_file))
+    cache = QueryCache()
+
+    first = search_captions_advanced(captions, "car", 60, cache, version)
+    assert cache.stats() == {"hits": 0, "misses": 1, "entries": 1}
+    assert search_captions_advanced(captions, "car", 60, cache, version) == first
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+
+# Test that video segments are only reused for the same video
+def test_split_video_keyed_by_content(tmp_path, monkeypatch):
+    """
+    Test that each video gets its own segments and a video is only split once.
+    """
+    gemini_api = import_gemini_api(monkeypatch)
+    runs = []
+
+    def fake_ffmpeg(command, check, capture_output):
+        runs.append(command[command.index("-i") + 1])
+        list_file = command[command.index("-segment_list") + 1]
+        with open(list_file, "w") as f:
+            f.write(f"segment_0.mp4,0.000000,5.000000\nsegment_1.mp4,5.200000,{len(runs) * 10}.000000\n")
+
+    monkeypatch.setattr(gemini_api.subprocess, "run", fake_ffmpeg)
+    first, second = tmp_path / "first.mp4", tmp_path / "second.mp4"
+    first.write_bytes(b"first video")
+    second.write_bytes(b"second video")
+    segment_folder = str(tmp_path / "segments")
+
+    first_segments = gemini_api.split_video(str(first), segment_folder, 5)
+    second_segments = gemini_api.split_video(str(second), segment_folder, 5)
+    assert runs == [str(first), str(second)]
+    assert [start for _, start in first_segments] == [0.0, 5.2]
+    assert os.path.dirname(first_segments[0][0]) != os.path.dirname(second_segments[0][0])
+    assert gemini_api.split_video(str(first), segment_folder, 5) == first_segments
+    assert len(runs) == 2
+
+
+# Test that a failing stage stops the streaming pipeline
+def test_streaming_pipeline_stops_on_error(tmp_path, monkeypatch):
+    """
+    Test that an error in the index stage stops every stage and is raised from run().
+    """
+    import threading
+    from benchmark import make_synthetic_video
+    from caption_index import CaptionIndex
+    from pipeline import StreamingPipeline
+
+    import_generate_captions(monkeypatch)
+    video_path = str(tmp_path / "video.mp4")
+    make_synthetic_video(video_path, [40, 50, 60, 45, 40, 50], size=(320, 240))
+
+    def fail(self, scene, caption):
+        raise ValueError("index is broken")
+
+    monkeypatch.setattr(CaptionIndex, "add", fail)
+    pipeline = StreamingPipeline(
+        video_path, str(tmp_path / "scene_images"), "model", str(tmp_path / "scene_captions.json"),
+        queue_size=1, batch_size=1,
+    )
+    errors = []
+
+    def run():
+        try:
+            pipeline.run()
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+
+    assert not thread.is_alive()
+    assert "index is broken" in str(errors[0])
+
+
+# Test that stage memory peaks are measured per stage
+def test_profiler_stage_peak():
+    """
+    Test that a stage's traced peak does not include memory freed before it started.
+    """
+    from profiling import Profiler
+
+    profiler = Profiler()
+    profiler.reset(trace_memory=True)
+    with profiler.stage("load"):
+        data = bytearray(20 * 1024 * 1024)
+        del data
+    with profiler.stage("search"):
+        small = [0] * 1000
+    report = profiler.report()
+    profiler.reset()
+
+    assert report["stages"]["load"]["peak_traced_bytes"] >= 20 * 1024 * 1024
+    assert report["stages"]["search"]["peak_traced_bytes"] < 10 * 1024 * 1024
+    assert report["peak_traced_bytes"] >= 20 * 1024 * 1024
+    assert len(small) == 1000
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import threading
+import time
+from PIL import Image
+from generate_captions import load_scene_image
+
+
+class ThumbnailCache:
+    """
+    Persistent cache of collage tiles keyed by source path, modification time and thumbnail size.
+
+    Each source and size has a single tile file that carries the source's
+    mtime as its own, so a rewritten source no longer matches its tile and
+    the new tile simply replaces the outdated one. The access time of a tile
+    records its last use, and the least recently used tiles are evicted once
+    the tiles exceed max_bytes.
+    """
+
+    def __init__(self, cache_dir=".thumbnails", max_bytes=256 * 1024 * 1024):
+        """
+        Args:
+            cache_dir (str): Directory holding the cached tiles.
+            max_bytes (int): Maximum total size of the tiles on disk.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._sizes = {
+            file: os.path.getsize(os.path.join(cache_dir, file))
+            for file in os.listdir(cache_dir)
+            if file.endswith(".jpg")
+        }
+
+    def _tile_path(self, image_path, thumbnail_size):
+        source = hashlib.sha1(os.path.abspath(image_path).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{source}_{thumbnail_size[0]}x{thumbnail_size[1]}.jpg")
+
+    def put(self, image_path, thumbnail_size=(200, 200)):
+        """
+        Creates and stores the tile of an image, replacing tiles of older versions.
+
+        Returns:
+            PIL.Image.Image: The thumbnail.
+        """
+        tile_path = self._tile_path(image_path, thumbnail_size)
+        mtime_ns = os.stat(image_path).st_mtime_ns
+        img = load_scene_image(image_path, thumbnail_size)
+        tmp_path = f"{tile_path}.{threading.get_ident()}.tmp"
+        img.save(tmp_path, format="JPEG", quality=90)
+        os.utime(tmp_path, ns=(time.time_ns(), mtime_ns))
+        with self._lock:
+            os.replace(tmp_path, tile_path)
+            self._sizes[os.path.basename(tile_path)] = os.path.getsize(tile_path)
+            self._evict()
+        return img
+
+    def get(self, image_path, thumbnail_size=(200, 200)):
+        """
+        Returns the thumbnail of an image, creating its tile on a miss.
+
+        Returns:
+            PIL.Image.Image: The thumbnail.
+        """
+        tile_path = self._tile_path(image_path, thumbnail_size)
+        try:
+            mtime_ns = os.stat(image_path).st_mtime_ns
+            if os.stat(tile_path).st_mtime_ns != mtime_ns:
+                raise OSError(f"Outdated tile {tile_path}")
+            with Image.open(tile_path) as tile:
+                tile.load()
+            os.utime(tile_path, ns=(time.time_ns(), mtime_ns))
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return self.put(image_path, thumbnail_size)
+        with self._lock:
+            self.hits += 1
+        return tile
+
+    def _evict(self):
+        total = sum(self._sizes.values())
+        if total <= self.max_bytes:
+            return
+        by_age = sorted(self._sizes, key=lambda f: os.stat(os.path.join(self.cache_dir, f)).st_atime_ns)
+        for file in by_age:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, file))
+            except OSError:
+                pass
+            total -= self._sizes.pop(file)